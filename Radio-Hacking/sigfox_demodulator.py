@@ -2,12 +2,18 @@
 # -*- coding: utf-8 -*-
 # Author: Yanis Alim
 
-from collections import namedtuple
+from timeit import default_timer as timer
+from collections import namedtuple, deque
 from scipy.signal import hilbert, chirp
+from multiprocessing import Pool
 import matplotlib.pyplot as plt
 import numpy as np
 import argparse
+import pathlib
+import json
+import glob
 import math  
+import sys
 
 SIGFOX_FRAME     = namedtuple("SIGFOX_FRAME", "PREAMBULE FTYPE FLAGS SEQUENCE_NUM DEVICE_ID PAYLOAD MAC CRC16")
 SYNC             = "1010" * 5
@@ -15,7 +21,10 @@ UPLINK_BAUDRATE  = 100
 CRC16_POLYNOMIAL = 0x1021
 MIN_LEN_FRAME    = 86
 MAX_LEN_FRAME    = 192
-MAX_FRAME_NUM    = 3
+MAX_BIT_ERRORS   = 2             # bit errors tolerated in the SYNC + FTYPE header of a frame
+SEARCH_CHUNK     = 1 << 16       # header positions compared at once by the frame search
+CHUNK_SIZE       = 1 << 20       # IQ samples demodulated at once by the memory-mapped mode
+STREAM_BLOCK     = 1 << 16       # IQ samples read at once by the streaming mode
 PACKET_AND_PAYLOD_LEN_FROM_FTYPE = {
 	0x06b : [8, 0 ], 0x6e0 : [8, 0 ], 0x034 : [8, 0 ],                  # class A
 	0x08d : [9, 1 ], 0x0d2 : [9, 1 ], 0x302 : [9, 1 ],                  # class B
@@ -35,149 +44,274 @@ DATA_FROM_REPLICA_TYPE = {
 def downlink_demodulate(file):
     pass
 
-def uplink_crc(data) :
-    data = bytes(int(data[i : i + 8], 2) for i in range(0, len(data), 8))
-    remainder = np.uint16(0)
-
-    for byte in data  :
-        remainder ^= (byte << 8)
+# 256-entry table of the CRC-16/0x1021 : remainder of each byte shifted through the register
+def crc16_table(polynomial=CRC16_POLYNOMIAL) :
+    table = np.zeros(256, dtype=np.uint16)
+    for byte in range(256) :
+        remainder = byte << 8
         for _ in range(8) :
-            remainder = ((remainder << 1) ^ CRC16_POLYNOMIAL) if (remainder & (1 << 15)) else (remainder << 1)
-    
-    return hex( ~ np.uint16(remainder) )
+            remainder = ((remainder << 1) ^ polynomial) if (remainder & (1 << 15)) else (remainder << 1)
+        table[byte] = remainder & 0xffff
+    return table
 
-# convolutional "encoder/decoder" : realizes the register shifts (Polynomial Multiplication/Division) using a Polynomial Generator 111 : X² + + X + 1
-def encode_decode_r3_fields(field, Enc_Dec):
-    field = bin(int('1'+field[2:], 16))[3:] 
-    w     = [int(field[i : i + 8], 2) for i in range(0, len(field), 8)]
-
-    b2    = 0
-    b1    = 0
-    j     = 0
-    result = []
-    while j < len(w):
-        n = w[j]
-        v = 0
-        i = 0
-        while i < 8 : 
-            b00 = (n & 128) >> 7
-            b01 = (n & 64) >> 6
-            v  += b00 if b2 == 0 else 1 - b00
-            v   = v << 1
-            v  += b01 if b1 == 0 else 1 - b01
-            b2  = b00 if Enc_Dec else (v & 2) >> 1
-            b1  = b01 if Enc_Dec else v & 1
-            v   = v << 1
-            n   = n << 2
-            i  += 2
-        v  >>= 1
-        w[j] = v
-        result.append("0x{:02x}".format(w[j]))
-        j   += 1
-
-    return "0x" + "".join( x.replace("0x",'') for x in result )
+CRC16_TABLE = crc16_table()
+
+# table-driven CRC of many packets of the same length at once : packets is a (nb_packets, nb_bytes) uint8 array
+def crc16_batch(packets) :
+    packets   = np.atleast_2d(np.asarray(packets, dtype=np.uint8))
+    remainder = np.zeros(len(packets), dtype=np.uint16)
+    for column in packets.T :
+        remainder = (remainder << 8) ^ CRC16_TABLE[(remainder >> 8) ^ column]
+    return ~remainder
 
+# validates the CRC of many packets at once, the packets are grouped by length : returns one boolean per packet
+def check_crc_batch(packets, crcs) :
+    packets = [np.frombuffer(bytes(packet), dtype=np.uint8) for packet in packets]
+    crcs    = np.asarray(crcs, dtype=np.uint16)
+    valid   = np.zeros(len(packets), dtype=bool)
+    for length in set(len(packet) for packet in packets) :
+        index = [i for i, packet in enumerate(packets) if len(packet) == length]
+        valid[index] = crc16_batch(np.stack([packets[i] for i in index])) == crcs[index]
+    return valid
+
+def uplink_crc(data) :
+    data = np.packbits(to_bits(data))
+    return "0x{:04x}".format(int(crc16_batch(data)[0]))
+
+# convolutional "encoder/decoder" : realizes the register shifts (Polynomial Multiplication/Division) using a Polynomial Generator 111 : X² + + X + 1
+# one byte through the register, 2 bits at a time, starting from the state (b2, b1) : returns the output byte and the new state
+def r3_byte(n, b2, b1, Enc_Dec):
+    v = 0
+    i = 0
+    while i < 8 : 
+        b00 = (n & 128) >> 7
+        b01 = (n & 64) >> 6
+        v  += b00 if b2 == 0 else 1 - b00
+        v   = v << 1
+        v  += b01 if b1 == 0 else 1 - b01
+        b2  = b00 if Enc_Dec else (v & 2) >> 1
+        b1  = b01 if Enc_Dec else v & 1
+        v   = v << 1
+        n   = n << 2
+        i  += 2
+    return v >> 1, b2, b1
 
 # convolutional "encoder/decoder" : realizes the register shifts (Polynomial Multiplication/Division) using a Polynomial Generator 101 : X² + 1
+# one byte through the register, 1 bit at a time, starting from the state (b2, b1) : returns the output byte and the new state
+def r2_byte(n, b2, b1, Enc_Dec):
+    v = 0
+    i = 0
+    while i < 8 :
+        b0 = (n & 128) >> 7
+        v += b0 if b2 == b1 else 1 - b0
+        b2 = b1
+        b1 = b0 if Enc_Dec else v & 1
+        n  = n << 1
+        v  = v << 1
+        i +=1
+    return v >> 1, b2, b1
+
+# (state, input byte) -> (output byte, next state) lookup tables, the state being b2 << 1 | b1
+def convolution_tables(register_byte, Enc_Dec):
+    output     = np.zeros((4, 256), dtype=np.uint8)
+    next_state = np.zeros((4, 256), dtype=np.uint8)
+    for state in range(4):
+        for n in range(256):
+            v, b2, b1 = register_byte(n, state >> 1, state & 1, Enc_Dec)
+            output[state, n]     = v
+            next_state[state, n] = (b2 << 1) | b1
+    return output, next_state
+
+CONVOLUTION_TABLES = {
+    (2, True) : convolution_tables(r2_byte, True),  (2, False) : convolution_tables(r2_byte, False),
+    (3, True) : convolution_tables(r3_byte, True),  (3, False) : convolution_tables(r3_byte, False),
+}
+
+# runs many fields of the same length through the register at once : fields is a (nb_fields, nb_bytes) uint8 array
+def convolve_fields(fields, replica_num, Enc_Dec):
+    output, next_state = CONVOLUTION_TABLES[replica_num, Enc_Dec]
+    fields = np.atleast_2d(np.asarray(fields, dtype=np.uint8))
+    result = np.empty_like(fields)
+    state  = np.zeros(len(fields), dtype=np.uint8)
+    for j in range(fields.shape[1]):
+        result[:, j] = output[state, fields[:, j]]
+        state        = next_state[state, fields[:, j]]
+    return result
+
+# "0x..." field to bytes : an odd number of digits leaves its last nibble alone in the last byte
+def field_to_bytes(field):
+    digits = field[2:]
+    if len(digits) % 2 :
+        return bytes.fromhex(digits[:-1]) + bytes([int(digits[-1], 16)])
+    return bytes.fromhex(digits)
+
+def encode_decode_fields(field, replica_num, Enc_Dec):
+    data = np.frombuffer(field_to_bytes(field), dtype=np.uint8)
+    return "0x" + convolve_fields(data, replica_num, Enc_Dec)[0].tobytes().hex()
+
+def encode_decode_r3_fields(field, Enc_Dec):
+    return encode_decode_fields(field, 3, Enc_Dec)
+
 def encode_decode_r2_fields(field, Enc_Dec):
-    field = bin(int('1'+field[2:], 16))[3:] 
-    w     = [int(field[i : i + 8], 2) for i in range(0, len(field), 8)]
-
-    b2    = 0
-    b1    = 0
-    j     = 0
-    result = []
-    while j < len(w):
-        n = w[j]
-        v = 0
-        i = 0
-        while i < 8 :
-            b0 = (n & 128) >> 7
-            v += b0 if b2 == b1 else 1 - b0
-            b2 = b1
-            b1 = b0 if Enc_Dec else v & 1
-            n  = n << 1
-            v  = v << 1
-            i +=1
-        v  >>= 1
-        w[j] = v
-        result.append("0x{:02x}".format(w[j]))
-        j   += 1
-
-    return "0x" + "".join( x.replace("0x",'') for x in result )
+    return encode_decode_fields(field, 2, Enc_Dec)
 
-def decode_replica(replica):
-    preambule    = "0x" + "a" * 5
-    ftype        = DATA_FROM_REPLICA_TYPE[replica.FTYPE][0]
-    len_payload  = DATA_FROM_REPLICA_TYPE[replica.FTYPE][1] * 2
-    replica_num  = DATA_FROM_REPLICA_TYPE[replica.FTYPE][2]
-    flag_seq_dev = encode_decode_r2_fields(replica.FLAGS + replica.SEQUENCE_NUM[2:] + replica.DEVICE_ID[2:],False) if replica_num == 2 else \
-                   encode_decode_r3_fields(replica.FLAGS + replica.SEQUENCE_NUM[2:] + replica.DEVICE_ID[2:],False)
-    flags        = flag_seq_dev[:3]
-    sequence_num = "0x" + flag_seq_dev[3:6]
-    device_id    = "0x" + flag_seq_dev[6:14]
-    payload_mac  = encode_decode_r2_fields(replica.PAYLOAD + replica.MAC[2:], False)[:len(replica.PAYLOAD + replica.MAC[2:])] if replica_num == 2 else \
-                   encode_decode_r3_fields(replica.PAYLOAD + replica.MAC[2:], False)[:len(replica.PAYLOAD + replica.MAC[2:])]
-    payload      = payload_mac[:2+len_payload]
-    mac          = "0x" + payload_mac[2+len_payload:]
-    crc16        = encode_decode_r2_fields(replica.CRC16, False)[:len(replica.CRC16)] if replica_num == 2 else \
-                   encode_decode_r3_fields(replica.CRC16, False)[:len(replica.CRC16)]
-    recovered    = SIGFOX_FRAME(preambule, ftype, flags, sequence_num, device_id, payload, mac, crc16)
+# reverses many 2nd/3rd replicas at once : the replicas with the same FTYPE have the same field lengths,
+# so each of their fields goes through the register as one (nb_replicas, nb_bytes) array
+def decode_replicas(replicas):
+    recovered = [None] * len(replicas)
+    for ftype in set(replica.FTYPE for replica in replicas):
+        index        = [i for i, replica in enumerate(replicas) if replica.FTYPE == ftype]
+        group        = [replicas[i] for i in index]
+        orig_ftype   = DATA_FROM_REPLICA_TYPE[ftype][0]
+        len_payload  = DATA_FROM_REPLICA_TYPE[ftype][1] * 2
+        replica_num  = DATA_FROM_REPLICA_TYPE[ftype][2]
+
+        flag_seq_dev = [r.FLAGS + r.SEQUENCE_NUM[2:] + r.DEVICE_ID[2:] for r in group]
+        payload_mac  = [r.PAYLOAD + r.MAC[2:] for r in group]
+        crc16        = [r.CRC16 for r in group]
+        decoded      = [convolve_fields([list(field_to_bytes(field)) for field in fields], replica_num, False)
+                        for fields in (flag_seq_dev, payload_mac, crc16)]
 
+        for k, i in enumerate(index):
+            fsd  = "0x" + decoded[0][k].tobytes().hex()
+            pm   = ("0x" + decoded[1][k].tobytes().hex())[:len(payload_mac[k])]
+            crc  = ("0x" + decoded[2][k].tobytes().hex())[:len(crc16[k])]
+            recovered[i] = SIGFOX_FRAME("0x" + "a" * 5, orig_ftype, fsd[:3], "0x" + fsd[3:6], "0x" + fsd[6:14],
+                                        pm[:2+len_payload], "0x" + pm[2+len_payload:], crc)
     return recovered
 
+def decode_replica(replica):
+    return decode_replicas([replica])[0]
+
+
+# bit arrays : the frames are parsed from numpy arrays of 0/1 values rather than from strings of '0'/'1'
+SYNC_BITS = np.frombuffer(SYNC.encode(), dtype=np.uint8) - ord('0')
+
+def to_bits(binary) :
+    if isinstance(binary, str) :
+        return np.frombuffer(binary.encode(), dtype=np.uint8) - ord('0')
+    return np.asarray(binary, dtype=np.uint8)
+
+def bits_to_int(bits) :
+    return int.from_bytes(np.packbits(bits).tobytes(), "big") >> (-len(bits) % 8)
+
+# frame search : the 32 bit headers SYNC + FTYPE of all the valid FTYPEs are compared to the bits at every position in one
+# pass, as a correlation of the +1/-1 bits : errors = (32 - correlation) / 2 is the Hamming distance to each header
+FTYPES          = np.array(sorted(PACKET_AND_PAYLOD_LEN_FROM_FTYPE))
+FRAME_LENGTHS   = np.array([48 + PACKET_AND_PAYLOD_LEN_FROM_FTYPE[ftype][0] * 8 for ftype in FTYPES])
+HEADER_PATTERNS = np.array([np.concatenate((SYNC_BITS, (ftype >> np.arange(11, -1, -1)) & 1)) for ftype in FTYPES], dtype=np.int16) * 2 - 1
+HEADER_LEN      = HEADER_PATTERNS.shape[1]
+
+# positions whose header is at most max_errors bits away from a valid one : positions, FTYPE indexes, errors
+def header_candidates(bits, max_errors=MAX_BIT_ERRORS) :
+    if len(bits) < HEADER_LEN :
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    windows = np.lib.stride_tricks.sliding_window_view(bits, HEADER_LEN)
+    positions, ftypes, errors = [], [], []
+    for start in range(0, len(windows), SEARCH_CHUNK) :
+        distances = (HEADER_LEN - (windows[start : start + SEARCH_CHUNK].astype(np.int16) * 2 - 1) @ HEADER_PATTERNS.T) // 2
+        best      = distances.argmin(axis=1)
+        least     = distances[np.arange(len(best)), best]
+        hits      = np.flatnonzero(least <= max_errors)
+        positions.append(start + hits)
+        ftypes.append(best[hits])
+        errors.append(least[hits])
+    return np.concatenate(positions), np.concatenate(ftypes), np.concatenate(errors)
 
-def parse_frames(binary_data) :
+# non overlapping frames of a bit array, in one pass over the candidates : (start, ftype, errors) for every complete frame,
+# and the start of the first frame that goes beyond the end of the bits (None if there is none)
+# around a frame start, the shifted preamble gives other candidates : the best one within the length of the sync is kept
+def find_frames(bits, max_errors=MAX_BIT_ERRORS) :
+    positions, ftypes, errors = header_candidates(bits, max_errors)
+    frames, end, i = [], 0, 0
+    while i < len(positions) :
+        if positions[i] < end :
+            i += 1
+            continue
+        j = np.searchsorted(positions, positions[i] + len(SYNC_BITS))
+        k = i + int(errors[i:j].argmin())
+        if positions[k] + FRAME_LENGTHS[ftypes[k]] > len(bits) :
+            return frames, int(positions[k])
+        frames.append((int(positions[k]), int(FTYPES[ftypes[k]]), int(errors[k])))
+        end = positions[k] + FRAME_LENGTHS[ftypes[k]]
+        i = k + 1
+    return frames, None
+
+# packet (FLAGS ... MAC) of a frame, as bytes, with the CRC it should match
+# the 2nd and 3rd replicas are convolutionally encoded : they are reversed first
+def frame_packet(frame) :
+    if frame.FTYPE in DATA_FROM_REPLICA_TYPE :
+        frame = decode_replica(frame)
+    packet = frame.FLAGS[2:] + frame.SEQUENCE_NUM[2:] + frame.DEVICE_ID[2:] + frame.PAYLOAD[2:] + frame.MAC[2:]
+    return bytes.fromhex(packet), int(frame.CRC16, 16)
+
+def check_frames_crc(frames) :
+    if not frames :
+        return []
+    packets, crcs = zip(*[frame_packet(frame[0]) for frame in frames])
+    return ["OK" if valid else "NOT OK" for valid in check_crc_batch(packets, crcs)]
+
+# parses the frame starting at start_frame : returns the frame, its raw hex value and the bit where it ends
+# ftype : the FTYPE found by the frame search (the bits may hold errors), None : read from the bits
+def parse_frame(bits, start_frame, ftype=None) :
     #            "01010"*5   "XXX"            "XXXX"
     # FRAME :   | PREAMBLE | FTYPE | PACKET | CRC16       X       XXX         XXXXXXXX    X....X   X..X
     #                                PACKET :         | FLAG | SEQUENCE_NUM | DEVICE_ID | PAYLAOD | MAC 
-    binary      = binary_data    
-    CRC         = "NOT OK"    
-    frames      = []
-    frame_count = 0
-    end_frame   = 0
-    while len(binary) > MIN_LEN_FRAME and frame_count < MAX_FRAME_NUM :
-        start_frame  = binary.index(SYNC)
-        binary       = binary[ start_frame : ]
-        ftype        = int(binary[20 :32],2)
-        len_packet   = PACKET_AND_PAYLOD_LEN_FROM_FTYPE[ftype][0] * 8
-        len_payload  = PACKET_AND_PAYLOD_LEN_FROM_FTYPE[ftype][1] * 8
-        len_mac      = len_packet - len_payload - ( 6 * 8 )
-        len_frame    = 20 + 12 + len_packet + 16    
-        end_payload  = 80 + len_payload
-        end_mac      = end_payload + len_mac
-        end_frame   += start_frame + len_frame
-
-        PREAMBULE    = "0x{:05x}".format(int(binary[0 :20],2))
-        FTYPE        = "0x{:03x}".format(int(binary[20:32],2))
-        FLAGS        = "0x{:01x}".format(int(binary[32:36],2))
-        SEQUENCE_NUM = "0x{:03x}".format(int(binary[36:48],2))
-        DEVICE_ID    = "0x{:08x}".format(int(binary[48:80],2))
-        PAYLOAD      = "0x{:0{}x}".format(int(binary[80:end_payload],2),      len_payload // 4)
-        MAC          = "0x{:0{}x}".format(int(binary[end_payload:end_mac],2), len_mac     // 4)
-        CRC16        = "0x{:04x}".format( int(binary[end_mac:len_frame], 2))
-
-        frame = SIGFOX_FRAME(PREAMBULE, FTYPE, FLAGS, SEQUENCE_NUM,  DEVICE_ID, PAYLOAD, MAC, CRC16)
-        hex_frame = hex( int(binary[20:len_frame],2) )
-        frames.append([frame,hex_frame])
-        
-        if frame_count == 0 and CRC16 == uplink_crc(binary[32:end_mac]) :
-            CRC = "OK"
-        binary = binary_data[end_frame:]
-        frame_count += 1
-
-    return frames, CRC
+    binary       = bits[ start_frame : ]
+    ftype        = bits_to_int(binary[20 :32]) if ftype is None else ftype
+    len_packet   = PACKET_AND_PAYLOD_LEN_FROM_FTYPE[ftype][0] * 8
+    len_payload  = PACKET_AND_PAYLOD_LEN_FROM_FTYPE[ftype][1] * 8
+    len_mac      = len_packet - len_payload - ( 6 * 8 )
+    len_frame    = 20 + 12 + len_packet + 16    
+    end_payload  = 80 + len_payload
+    end_mac      = end_payload + len_mac
 
-def hex_to_sigfox(string) :
+    PREAMBULE    = "0x{:05x}".format(bits_to_int(binary[0 :20]))
+    FTYPE        = "0x{:03x}".format(ftype)
+    FLAGS        = "0x{:01x}".format(bits_to_int(binary[32:36]))
+    SEQUENCE_NUM = "0x{:03x}".format(bits_to_int(binary[36:48]))
+    DEVICE_ID    = "0x{:08x}".format(bits_to_int(binary[48:80]))
+    PAYLOAD      = "0x{:0{}x}".format(bits_to_int(binary[80:end_payload]),      len_payload // 4) if len_payload else "0x"
+    MAC          = "0x{:0{}x}".format(bits_to_int(binary[end_payload:end_mac]), len_mac     // 4)
+    CRC16        = "0x{:04x}".format(bits_to_int(binary[end_mac:len_frame]))
+
+    frame = SIGFOX_FRAME(PREAMBULE, FTYPE, FLAGS, SEQUENCE_NUM,  DEVICE_ID, PAYLOAD, MAC, CRC16)
+    hex_frame = hex( bits_to_int(binary[20:len_frame]) )
+    return frame, hex_frame, start_frame + len_frame
+
+# every frame of the recording, with its offset in bits : [frame, hex_frame, start_frame]
+def parse_frames(binary_data, max_errors=MAX_BIT_ERRORS) :
+    bits   = to_bits(binary_data)
+    frames = []
+    for start_frame, ftype, _ in find_frames(bits, max_errors)[0] :
+        frame, hex_frame, _ = parse_frame(bits, start_frame, ftype)
+        frames.append([frame, hex_frame, start_frame])
+
+    return frames, check_frames_crc(frames)
+
+def replica_from_hex(string) :
     if string.startswith("0x") :
         string =  string[2:]
     if not string.startswith("aaaaa") :
         string = "aaaaa" + string
     binary_data = bin(int('1'+string, 16))[3:]
-    replica = parse_frames(binary_data)
-    frame = decode_replica(replica[0][0][0])
+    return parse_frame(to_bits(binary_data), 0)[0]
+
+# reverses a list of 2nd/3rd replicas given as hex strings
+def reverse_replicas(strings) :
+    return decode_replicas([replica_from_hex(string) for string in strings])
+
+def hex_to_sigfox(string) :
+    frame = reverse_replicas([string])[0]
     print("[*] Reversed replica: \n{}".format(frame))
 
+# reverses the replicas of a file, one hex string per line
+def hex_file_to_sigfox(file) :
+    with open(file) as f :
+        strings = [line.strip() for line in f if line.strip()]
+    for string, frame in zip(strings, reverse_replicas(strings)) :
+        print("[*] Replica: {}\n[*] Reversed replica: \n{}\n".format(string, frame))
+
 
 def exploit_envelope(baseband_envelope, average_power, bit_rate) :
     binary_data = ""
@@ -194,31 +328,236 @@ def exploit_envelope(baseband_envelope, average_power, bit_rate) :
                 binary_data += ( "0" + "1" * (bit_count - 1) )
     return binary_data
 
-def uplink_demodulate(file) :
+# memory-mapped IQ recording, read by chunks of chunk_size complex samples (interleaved float32 I and Q)
+def iq_chunks(file, chunk_size=CHUNK_SIZE) :
+    IQ = np.memmap(file, dtype=np.float32, mode='r')
+    IQ = IQ[: len(IQ) // 2 * 2].view(np.complex64)
+    for start in range(0, len(IQ), chunk_size) :
+        yield IQ[start : start + chunk_size]
+
+#                           __________________
+# get signal envelope r = \/ (I^2 + Q^2) / 2    https://www.tek.com/blog/calculating-rf-power-iq-samples
+def chunk_envelope(chunk) :
+    return np.abs(chunk) / math.sqrt(2)
+
+# lengths of the runs above the threshold that end inside the chunk
+# run_length is the length of the run still open at the end of the previous chunk, the new open run length is returned with the lengths
+def threshold_runs(mask, run_length) :
+    edges   = np.diff(mask.view(np.int8), prepend=np.int8(0), append=np.int8(0))
+    starts  = np.flatnonzero(edges == 1)
+    ends    = np.flatnonzero(edges == -1)
+    lengths = ends - starts
+
+    if run_length :
+        if len(starts) and starts[0] == 0 :                  # the open run goes on in this chunk
+            lengths[0] += run_length
+        else :                                               # the open run ended on the first sample of this chunk
+            lengths = np.concatenate(([run_length], lengths))
+            ends    = np.concatenate(([0], ends))
+
+    if len(ends) and ends[-1] == len(mask) :                 # the last run is still open
+        return lengths[:-1], lengths[-1]
+    return lengths, 0
+
+# same decoding as exploit_envelope, from the run lengths : each run of bit_count bits gives "0" + "1" * (bit_count - 1)
+def bits_from_runs(lengths, bit_rate) :
+    bit_counts = np.round(lengths / bit_rate).astype(np.int64)
+    bit_counts = bit_counts[bit_counts > 0]
+    bits = np.ones(bit_counts.sum(), dtype=np.uint8)
+    bits[np.cumsum(bit_counts) - bit_counts] = 0
+    return bits
+
+# chunked demodulation : memory only depends on chunk_size, not on the recording length
+def uplink_demodulate_bits(file, Fs=1000000, chunk_size=CHUNK_SIZE) :
+    bit_rate = Fs / UPLINK_BAUDRATE
+
+    # first pass : calculate the average of the signal power over the whole recording
+    average_power = max((chunk_envelope(chunk).max() for chunk in iq_chunks(file, chunk_size)), default=0) / 2
+
+    # second pass : run lengths above the average power, carried across the chunk boundaries
+    bits = []
+    run_length = 0
+    for chunk in iq_chunks(file, chunk_size) :
+        lengths, run_length = threshold_runs(chunk_envelope(chunk) > average_power, run_length)
+        bits.append(bits_from_runs(lengths, bit_rate))
+
+    return np.concatenate(bits) if bits else np.zeros(0, dtype=np.uint8)
+
+def uplink_demodulate(file, chunk_size=None) :
     # read I and Q data 
     Fs = 1000000
     bit_rate = Fs / UPLINK_BAUDRATE
-    IQ = np.fromfile(file, dtype=np.float32)
-    I = IQ[0::2]
-    Q = IQ[1::2]
-    
-    #                           __________________
-    # get signal envelope r = \/ (I^2 + Q^2) / 2    https://www.tek.com/blog/calculating-rf-power-iq-samples
-    baseband_envelope = []
-    for i in range(len(I)):
-        baseband_envelope.append( math.sqrt( (I[i]**2 + Q[i]**2) / 2 ) )
-
-    # calculate the average  of the signal power to spot the amplitude change on the sigfox DBPSK modulation
-    average_power = max(baseband_envelope)/2
-    
-    # get the binary data of the signal
-    binary_data   = exploit_envelope(baseband_envelope, average_power, bit_rate)
+
+    if chunk_size :
+        binary_data = uplink_demodulate_bits(file, Fs, chunk_size)
+    else :
+        IQ = np.fromfile(file, dtype=np.float32)
+        I = IQ[0::2]
+        Q = IQ[1::2]
+
+        #                           __________________
+        # get signal envelope r = \/ (I^2 + Q^2) / 2    https://www.tek.com/blog/calculating-rf-power-iq-samples
+        baseband_envelope = []
+        for i in range(len(I)):
+            baseband_envelope.append( math.sqrt( (I[i]**2 + Q[i]**2) / 2 ) )
+
+        # calculate the average  of the signal power to spot the amplitude change on the sigfox DBPSK modulation
+        average_power = max(baseband_envelope)/2
+
+        # get the binary data of the signal
+        binary_data   = exploit_envelope(baseband_envelope, average_power, bit_rate)
  
     # parse the binary data to sigfox frames
     frames, CRC = parse_frames(binary_data)
-    for i in range(3) :
-        print("[*] Parsed frame:\n{}\n[*] Raw frame: {}\n".format(frames[i][0], frames[i][1]))
-    print("[*] CRC: {}".format(CRC))
+    for i in range(len(frames)) :
+        print("[*] Parsed frame:\n{}\n[*] Raw frame: {}\n[*] CRC: {}\n".format(frames[i][0], frames[i][1], CRC[i]))
+
+# JSON record of a frame : the replicas are reversed to find the device and sequence number of their message
+def frame_record(frame, hex_frame, offset, crc, file) :
+    original = decode_replica(frame) if frame.FTYPE in DATA_FROM_REPLICA_TYPE else frame
+    return {
+        "file"         : str(file),
+        "offset"       : int(offset),                                # in bits from the start of the demodulated data
+        "ftype"        : frame.FTYPE,
+        "replica"      : DATA_FROM_REPLICA_TYPE[frame.FTYPE][2] if frame.FTYPE in DATA_FROM_REPLICA_TYPE else 1,
+        "device_id"    : original.DEVICE_ID,
+        "sequence_num" : original.SEQUENCE_NUM,
+        "payload"      : original.PAYLOAD,
+        "crc"          : crc,
+        "raw"          : hex_frame,
+    }
+
+# JSON records of the frames of a recording
+def scan_recording(file, chunk_size=CHUNK_SIZE) :
+    try :
+        frames, CRC = parse_frames(uplink_demodulate_bits(file, chunk_size=chunk_size))
+    except (ValueError, KeyError) as err :          # unknown FTYPE, truncated frame ...
+        return [{"file" : str(file), "error" : repr(err)}]
+
+    return [frame_record(frame, hex_frame, offset, crc, file) for (frame, hex_frame, offset), crc in zip(frames, CRC)]
+
+def recordings(path) :
+    if pathlib.Path(path).is_dir() :
+        return sorted(str(p) for p in pathlib.Path(path).iterdir() if p.is_file())
+    return sorted(glob.glob(path))
+
+# an initial frame and its replicas carry the same device ID and sequence number : they are collapsed to one message
+def group_messages(records) :
+    messages = {}
+    for record in records :
+        if "error" in record :
+            continue
+        message = messages.setdefault((record["device_id"], record["sequence_num"]), {
+            "device_id"    : record["device_id"],
+            "sequence_num" : record["sequence_num"],
+            "payload"      : record["payload"],
+            "crc"          : "NOT OK",
+            "copies"       : [],
+        })
+        message["copies"].append({"file" : record["file"], "offset" : record["offset"], "replica" : record["replica"], "crc" : record["crc"]})
+        if record["crc"] == "OK" and message["crc"] != "OK" :      # keep the payload of a copy with a valid CRC
+            message["crc"]     = "OK"
+            message["payload"] = record["payload"]
+    return list(messages.values())
+
+# demodulates the recordings of a directory or glob on a process pool, one JSONL record per frame
+def uplink_scan(path, output=None, messages_output=None, jobs=None, chunk_size=CHUNK_SIZE) :
+    files   = recordings(path)
+    records = []
+    out     = open(output, "w") if output else None
+    with Pool(jobs) as pool :
+        for file_records in pool.imap_unordered(_scan_recording, [(file, chunk_size) for file in files]) :
+            for record in file_records :
+                print(json.dumps(record), file=out)
+            records += file_records
+    if out :
+        out.close()
+
+    messages = group_messages(records)
+    if messages_output :
+        with open(messages_output, "w") as f :
+            for message in messages :
+                print(json.dumps(message), file=f)
+    print("[*] {} recordings, {} frames, {} messages".format(len(files), sum("error" not in r for r in records), len(messages)), file=sys.stderr)
+    return records, messages
+
+def _scan_recording(args) :
+    return scan_recording(*args)
+
+# streaming receiver : the IQ samples are fed by blocks, and each frame is returned as soon as its last bit is demodulated.
+# Memory does not grow with the stream : only the open run length, the block maxima of about one frame duration
+# (threshold = half of their maximum, the streaming counterpart of the max / 2 of a whole recording) and the bits not
+# consumed yet (less than one frame plus one block) are kept.
+class UplinkStream :
+    def __init__(self, Fs=1000000, block_size=STREAM_BLOCK, max_errors=MAX_BIT_ERRORS) :
+        self.Fs         = Fs
+        self.max_errors = max_errors
+        self.bit_rate   = Fs / UPLINK_BAUDRATE
+        self.peaks      = deque(maxlen=max(1, math.ceil(MAX_LEN_FRAME * self.bit_rate / block_size)))
+        self.run_length = 0
+        self.bits       = np.zeros(0, dtype=np.uint8)
+        self.bit_offset = 0                                          # position of bits[0] in the demodulated stream
+        self.samples    = 0
+
+    def feed(self, chunk) :
+        envelope = chunk_envelope(chunk)
+        self.peaks.append(envelope.max() if len(envelope) else 0)
+        lengths, self.run_length = threshold_runs(envelope > max(self.peaks) / 2, self.run_length)
+        self.samples += len(chunk)
+        self.bits = np.concatenate((self.bits, bits_from_runs(lengths, self.bit_rate)))
+        return self.extract()
+
+    def drop(self, nb_bits) :
+        self.bits        = self.bits[nb_bits:]
+        self.bit_offset += nb_bits
+
+    # complete frames of the buffered bits : [frame, hex_frame, offset]
+    def extract(self) :
+        found, pending = find_frames(self.bits, self.max_errors)
+        frames = []
+        for start, ftype, _ in found :
+            frame, hex_frame, end = parse_frame(self.bits, start, ftype)
+            frames.append([frame, hex_frame, self.bit_offset + start])
+        if pending is not None :                                     # waits for the last bits of this frame
+            self.drop(pending)
+        else :                                                       # keeps the bits that can still begin a header
+            self.drop(max(end if found else 0, len(self.bits) - HEADER_LEN + 1))
+        return frames
+
+# interleaved float32 IQ blocks of a binary stream (stdin, FIFO ...), until the end of the stream
+def iq_stream_blocks(stream, block_size=STREAM_BLOCK) :
+    while True :
+        data = stream.read(block_size * 8)
+        if len(data) < 8 :
+            break
+        yield np.frombuffer(data[: len(data) // 8 * 8], dtype=np.complex64)
+
+# demodulates a live feed ("-" : stdin) and writes one JSONL record per frame as soon as it is decoded
+#   stream_time : seconds of stream received when the frame was decoded
+#   latency_ms  : time between the reception of the block holding the last bit of the frame and the output of its record
+#                 (the block itself lasts block_size / Fs)
+def uplink_stream(source, output=None, Fs=1000000, block_size=STREAM_BLOCK) :
+    stream   = sys.stdin.buffer if source == "-" else open(source, "rb")
+    out      = open(output, "w") if output else sys.stdout
+    receiver = UplinkStream(Fs, block_size)
+    count    = 0
+    try :
+        for chunk in iq_stream_blocks(stream, block_size) :
+            received = timer()
+            frames   = receiver.feed(chunk)
+            for (frame, hex_frame, offset), crc in zip(frames, check_frames_crc(frames)) :
+                record = frame_record(frame, hex_frame, offset, crc, source)
+                record["stream_time"] = receiver.samples / Fs
+                record["latency_ms"]  = (timer() - received) * 1000
+                print(json.dumps(record), file=out, flush=True)
+                count += 1
+    finally :
+        if stream is not sys.stdin.buffer :
+            stream.close()
+        if out is not sys.stdout :
+            out.close()
+    print("[*] {} frames in {:.1f}s of stream".format(count, receiver.samples / Fs), file=sys.stderr)
+    return count
 
 
 if __name__ == '__main__' :
@@ -228,12 +567,25 @@ if __name__ == '__main__' :
     parser.add_argument("-f", "--file", help="Complex file containing the uplink recording to be demodulated", required=False, dest="file")
     parser.add_argument("-d", "--decode", choices=["uplink", "downlink"], help = "Decode content of uplink/downlink frame", required=False, dest="decode")
     parser.add_argument("-r", "--reverse", help = "Reverse a 2nd or 3rd replica frame to the original one", required=False, dest="reverse")
+    parser.add_argument("-R", "--reverse-file", help = "Reverse the 2nd or 3rd replica frames of a file, one per line", required=False, dest="reverse_file")
+    parser.add_argument("-c", "--chunk-size", type=int, help = "Demodulate the memory-mapped recording by chunks of this many IQ samples", required=False, dest="chunk_size")
+    parser.add_argument("-b", "--batch", help = "Directory or glob of uplink recordings to demodulate on a process pool", required=False, dest="batch")
+    parser.add_argument("-j", "--jobs", type=int, help = "Number of worker processes of the batch mode (default: one per core)", required=False, dest="jobs")
+    parser.add_argument("-o", "--output", help = "JSONL file receiving one record per decoded frame (default: stdout)", required=False, dest="output")
+    parser.add_argument("-s", "--stream", help = "Demodulate a live float32 IQ feed from a FIFO, or from stdin with -", required=False, dest="stream")
+    parser.add_argument("-m", "--messages", help = "JSONL file receiving the messages, initial frames and replicas collapsed", required=False, dest="messages")
 
     args = parser.parse_args()
-    if args.decode == "uplink" :
-        uplink_demodulate(args.file)
+    if args.stream :
+        uplink_stream(args.stream, args.output)
+    elif args.batch :
+        uplink_scan(args.batch, args.output, args.messages, args.jobs, args.chunk_size or CHUNK_SIZE)
+    elif args.decode == "uplink" :
+        uplink_demodulate(args.file, args.chunk_size)
     else :
         downlink_demodulate(args.file)
     if args.reverse :
         hex_to_sigfox(args.reverse)
+    if args.reverse_file :
+        hex_file_to_sigfox(args.reverse_file)
 
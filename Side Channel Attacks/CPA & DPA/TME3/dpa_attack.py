@@ -77,8 +77,11 @@ def load_traces(i='') :
 def intermediate(pt, key):
     return sbox[pt ^ key]
 
-def DPA_Attack(traces, pt, destinguisher="HW_Threshold") :
+# points/ranges : leakage points (HW) and ranges (MSB/LSB) of each byte, e.g. from TME4/leakage_assessment.py
+def DPA_Attack(traces, pt, destinguisher="HW_Threshold", points=None, ranges=None) :
     
+    leakage_points_ = leakage_points if points is None else points
+    leakage_ranges_ = leakage_ranges if ranges is None else ranges
     mean_diffs = np.zeros(256)
     threshold = 4
     recovered_key = []
@@ -93,7 +96,7 @@ def DPA_Attack(traces, pt, destinguisher="HW_Threshold") :
             for trace_index in range(len(traces)):
                 
                 if destinguisher.upper() == "HW" :
-                    avg_point = leakage_points[bnum]
+                    avg_point = leakage_points_[bnum]
                     hw = HW[intermediate( pt[trace_index][bnum], guess)]
                     
                     if hw < threshold :
@@ -102,7 +105,7 @@ def DPA_Attack(traces, pt, destinguisher="HW_Threshold") :
                         group2.append(traces[trace_index][avg_point])
                 
                 else :
-                    avg_range = leakage_ranges[bnum]
+                    avg_range = leakage_ranges_[bnum]
                     lsb_msb = intermediate( pt[trace_index][bnum], guess)
 
                     if  destinguisher.upper() == "MSB" :
@@ -131,11 +134,66 @@ def DPA_Attack(traces, pt, destinguisher="HW_Threshold") :
     
     return recovered_key
 
+# vectorized version of DPA_Attack : for each byte, the partition of the traces is computed for all the guesses at once
+# as a boolean mask of shape (256, nb_traces), and the group means are obtained from masked sums (matrix products)
+
+SBOX_ARRAY = np.asarray(sbox, dtype=np.uint8)
+HW_ARRAY   = np.asarray(HW, dtype=np.uint8)
+GUESSES    = np.arange(256, dtype=np.uint8)
+
+# hypothesis : the precomputed (256, nb_traces) matrix of the destinguisher model (TME4/hypothesis.py, model = destinguisher)
+
+def partition_masks(pt_byte, destinguisher, hypothesis=None) :
+    if hypothesis is not None :
+        hypothesis = np.asarray(hypothesis)
+        return hypothesis < 4 if destinguisher.upper() == "HW" else hypothesis != 0
+
+    sbox_out = SBOX_ARRAY[np.bitwise_xor.outer(GUESSES, np.asarray(pt_byte, dtype=np.uint8))]  # sbox[pt ^ guess] : (256, nb_traces)
+
+    if destinguisher.upper() == "HW" :
+        return HW_ARRAY[sbox_out] < 4                   # group1 : hw < threshold
+    elif destinguisher.upper() == "MSB" :
+        return (sbox_out & 0x80) != 0                   # group1 : msb set
+    elif destinguisher.upper() == "LSB" :
+        return (sbox_out & 0x01) != 0                   # group1 : lsb set
+
+    print("[!] Unknown destinguisher: {}".format(destinguisher))
+    sys.exit(-1)
+
+def DPA_Attack_vectorized(traces, pt, destinguisher="HW_Threshold", points=None, ranges=None, hypotheses=None) :
+
+    points = leakage_points if points is None else points
+    ranges = leakage_ranges if ranges is None else ranges
+    traces = np.asarray(traces, dtype=np.float64)
+    pt = np.asarray(pt, dtype=np.uint8)
+    recovered_key = []
+
+    for bnum in range(16):
+        if destinguisher.upper() == "HW" :
+            samples = traces[:, [points[bnum]]]
+        else :
+            samples = traces[:, ranges[bnum]]
+
+        mask = partition_masks(pt[:, bnum], destinguisher, None if hypotheses is None else hypotheses[bnum])
+
+        group1_len = mask.sum(axis=1)[:, None]
+        group2_len = len(traces) - group1_len
+        group1_sum = mask.astype(np.float64) @ samples  # ∑ of the group1 samples for every guess : (256, nb_samples)
+        group2_sum = samples.sum(axis=0) - group1_sum   # the group2 samples are all the remaining ones
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_diffs = np.max(abs(group1_sum / group1_len - group2_sum / group2_len), axis=1)
+
+        recovered_key.append(int(np.nan_to_num(mean_diffs).argmax()))  # an empty group never wins, like in DPA_Attack
+
+    return recovered_key
+
 if __name__ == '__main__' :
     for i in range(1) :
         store_traces(i)
     
     num_traces = 100
+    vectorized = True
     destinguisher = "HW"
     #destinguisher = "MSB"
     #destinguisher = "LSB"
@@ -143,7 +201,10 @@ if __name__ == '__main__' :
     for i in range(1):
         traces, pt, key = load_traces(i)
         start = timer()
-        recovered_key = DPA_Attack(traces[:num_traces], pt, destinguisher)
+        if vectorized :
+            recovered_key = DPA_Attack_vectorized(traces[:num_traces], pt[:num_traces], destinguisher)
+        else :
+            recovered_key = DPA_Attack(traces[:num_traces], pt, destinguisher)
         end = timer()
         print("Recovered key: {}".format(recovered_key))
         print("Correct   key: {}".format(list(key)))
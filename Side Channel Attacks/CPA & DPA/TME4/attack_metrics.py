@@ -0,0 +1,96 @@
+from database_utils import Database, KEY_LEN
+from cpa_bridge import windows_layout
+from leakage_windows import leakage_ranges
+from cpa_accumulator import CPAAccumulator
+import numpy as np
+import argparse
+
+# Success rate and guessing entropy of the CPA attack as a function of the number of traces.
+# The traces are swept once per ordering : the CPAAccumulator holds the prefix sums, and at every checkpoint
+# the rank of the correct key byte is read from the current correlations. No attack is rerun from scratch.
+
+# rank of the correct byte among the 256 guesses (0 : the attack recovers it)
+def key_ranks(peaks, key):
+    correct = peaks[np.arange(KEY_LEN), key]
+    return (peaks > correct[:, None]).sum(axis=1)
+
+def rank_curve(waves, textin, key, checkpoints, order, ranges=leakage_ranges):
+    accumulator = CPAAccumulator(waves.shape[1], ranges)
+    ranks = np.zeros((len(checkpoints), KEY_LEN), dtype=np.int64)
+    done = 0
+    for i, nb_traces in enumerate(checkpoints):
+        batch = np.sort(order[done:nb_traces])                                  # sorted indices : sequential reads of memory maps
+        accumulator.update(waves[batch], textin[batch])
+        ranks[i] = key_ranks(accumulator.peaks(), key)
+        done = nb_traces
+    return ranks
+
+# the first ordering is the capture order, the other ones are random permutations of the traces
+#   success_rate     : (checkpoints,) ratio of orderings where the whole key is recovered
+#   success_rate_byte: (checkpoints, KEY_LEN) ratio of orderings where each byte is recovered
+#   guessing_entropy : (checkpoints, KEY_LEN) average rank of each correct byte
+
+def attack_curves(waves, textin, key, step=10, nb_orderings=10, ranges=leakage_ranges, seed=0):
+    rng = np.random.default_rng(seed)
+    key = np.asarray(key, dtype=np.uint8)
+    textin = np.asarray(textin, dtype=np.uint8)
+    checkpoints = np.arange(step, len(waves) + 1, step)
+
+    orders = [np.arange(len(waves))] + [rng.permutation(len(waves)) for _ in range(nb_orderings - 1)]
+    ranks = np.stack([rank_curve(waves, textin, key, checkpoints, order, ranges) for order in orders])
+
+    return {
+        "nb_traces"         : checkpoints,
+        "success_rate"      : (ranks == 0).all(axis=2).mean(axis=0),
+        "success_rate_byte" : (ranks == 0).mean(axis=0),
+        "guessing_entropy"  : ranks.mean(axis=0),
+    }
+
+def save_csv(curves, file):
+    header = ["nb_traces", "success_rate", "mean_guessing_entropy"] + \
+             ["sr_byte{}".format(b) for b in range(KEY_LEN)] + ["ge_byte{}".format(b) for b in range(KEY_LEN)]
+    rows = np.column_stack((curves["nb_traces"], curves["success_rate"], curves["guessing_entropy"].mean(axis=1),
+                            curves["success_rate_byte"], curves["guessing_entropy"]))
+    np.savetxt(file, rows, delimiter=",", header=",".join(header), comments="", fmt="%g")
+
+# traces of the database, only the leakage ranges are loaded : the ranges are given back relative to the loaded columns
+def load_db(db_file, nb_traces, offset, nb_samples, backend="sqlite"):
+    db = Database(file=db_file, backend=backend)
+    ranges = db.sample_ranges(leakage_ranges)                                    # windows of a decimated trace store
+    _, starts, intervals = windows_layout(ranges, nb_samples)
+    waves, textin, keys = db.load(nb_traces, offset, nb_samples, ranges)
+    return waves, textin, keys[0], [(start, start + length) for start, length in zip(starts, intervals)]
+
+# traces of TME3/dpa_attack.py store_traces
+def load_npy(i):
+    waves  = np.load("DPA_traces{}.npy".format(i), mmap_mode='r')
+    textin = np.load("DPA_textin{}.npy".format(i))
+    key    = np.load("DPA_keys{}.npy".format(i))
+    return waves, textin, key, leakage_ranges
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description="Success rate and guessing entropy curves of the CPA attack")
+    parser.add_argument("-f", "--file", default="traces.db", help="Trace database")
+    parser.add_argument("--backend", choices=["sqlite", "store"], default="sqlite", help="Database backend")
+    parser.add_argument("--npy", help="Use the DPA_traces<NPY>.npy/DPA_textin<NPY>.npy/DPA_keys<NPY>.npy files instead of the database")
+    parser.add_argument("-n", "--nb-traces", type=int, default=500, help="Number of traces")
+    parser.add_argument("--offset", type=int, default=0, help="Offset of the first trace in the database")
+    parser.add_argument("-s", "--samples", type=int, default=3000, help="Number of samples per trace")
+    parser.add_argument("--step", type=int, default=10, help="Number of traces between two checkpoints")
+    parser.add_argument("--orderings", type=int, default=10, help="Number of trace orderings")
+    parser.add_argument("-o", "--output", default="attack_curves.csv", help="CSV file of the curves")
+    args = parser.parse_args()
+
+    if args.npy is not None:
+        waves, textin, key, ranges = load_npy(args.npy)
+        waves, textin = waves[:args.nb_traces], textin[:args.nb_traces]
+    else:
+        waves, textin, key, ranges = load_db(args.file, args.nb_traces, args.offset, args.samples, args.backend)
+
+    curves = attack_curves(waves, textin, key, args.step, args.orderings, ranges)
+    save_csv(curves, args.output)
+
+    failures = np.flatnonzero(curves["success_rate"] < 1)
+    stable = 0 if len(failures) == 0 else failures[-1] + 1                     # first checkpoint after the last failure
+    print("[*] Curves saved to {}".format(args.output))
+    print("[*] Key always recovered from {} traces".format(curves["nb_traces"][stable] if stable < len(curves["nb_traces"]) else "more than {}".format(len(waves))))
@@ -0,0 +1,148 @@
+from synthetic_traces import generate_traces
+from leakage_windows import leakage_ranges
+from timeit import default_timer as timer
+from cpa_accumulator import CPAAccumulator
+from cpa_engine import KEY_LEN, cpa_attack
+from profiler import reset_peak_rss, peak_rss_since_mb
+from multiprocessing import get_context
+import numpy as np
+import tracemalloc
+import argparse
+import pathlib
+import sys
+import os
+
+# TME3 DPA attacks
+sys.path.append(str(pathlib.Path(__file__).absolute().parent.parent / "TME3"))
+
+# each engine takes the waves and the plain texts and returns the recovered key
+
+def dpa_engine(vectorized):
+    from dpa_attack import DPA_Attack, DPA_Attack_vectorized
+    attack = DPA_Attack_vectorized if vectorized else DPA_Attack
+    return lambda waves, textin : attack(waves, textin, "HW")
+
+def c_engine(nb_threads):
+    from cpa_bridge import load_lib, windows_layout, cpa_attack_parallel
+    lib = load_lib()
+    columns, starts, intervals = windows_layout(leakage_ranges, None)
+
+    def attack(waves, textin):
+        return cpa_attack_parallel(lib, np.ascontiguousarray(waves[:, columns]), textin, starts, intervals, nb_threads)[0]
+    return attack
+
+# original cpa_attack of the C library on t_trace structures (baseline of the C engines)
+def c_baseline_engine():
+    from cpa_bridge import load_lib, c_traces, cpa_attack_traces
+    lib = load_lib()
+
+    def attack(waves, textin):
+        traces, intervals, _windows = c_traces(waves, textin, leakage_ranges)
+        return cpa_attack_traces(lib, traces, intervals)
+    return attack
+
+def accumulator_engine(waves, textin):
+    return CPAAccumulator(waves.shape[1], leakage_ranges).update(waves, textin).key()
+
+ENGINES = {
+    "dpa"            : lambda : dpa_engine(False),
+    "dpa_vectorized" : lambda : dpa_engine(True),
+    "cpa_c_baseline" : c_baseline_engine,
+    "cpa_c"          : lambda : c_engine(1),
+    "cpa_c_parallel" : lambda : c_engine(os.cpu_count()),
+    "cpa_numpy"      : lambda : lambda waves, textin : cpa_attack(waves, textin, leakage_ranges)[0],
+    "cpa_accumulator": lambda : accumulator_engine,
+}
+
+def load_engines(names):
+    engines = {}
+    for name in names:
+        try:
+            engines[name] = ENGINES[name]()
+        except (ImportError, OSError) as err:                     # missing TME3 dependencies or C library not built
+            print("[!] Skipping {} : {}".format(name, err))
+    return engines
+
+def run(attack, waves, textin, repeat):
+    times = []
+    for _ in range(repeat):
+        start = timer()
+        key = attack(waves, textin)
+        times.append(timer() - start)
+
+    # separate run : tracing slows down the allocations
+    #   py_heap : peak of the python allocations (tracemalloc), the malloc of the C library is not seen
+    tracemalloc.start()
+    attack(waves, textin)
+    py_heap = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return np.asarray(key, dtype=np.uint8), min(times), py_heap
+
+# peak RSS added by one cold run of an engine, C allocations included (Linux only, None elsewhere). It runs in a fresh
+# process : after a first run the allocator reuses the memory it already holds, and the RSS no longer grows.
+def cold_rss(name, nb_traces, nb_samples, noise, seed):
+    waves, textin, _ = generate_traces(nb_traces, nb_samples, noise, seed=seed)
+    attack = ENGINES[name]()
+    start_rss = reset_peak_rss()
+    attack(waves, textin)
+    return peak_rss_since_mb(start_rss)
+
+def benchmark(engines, trace_counts, nb_samples=3000, noise=0.02, repeat=1, seed=0, dpa_max_traces=500):
+    results = []
+    pool = get_context("spawn").Pool(1, maxtasksperchild=1)       # one fresh process per measure of the RSS
+    for nb_traces in trace_counts:
+        waves, textin, key = generate_traces(nb_traces, nb_samples, noise, seed=seed)
+        for name, attack in engines.items():
+            if name == "dpa" and nb_traces > dpa_max_traces:      # the pure python DPA does not scale
+                continue
+            recovered_key, elapsed, py_heap = run(attack, waves, textin, repeat)
+            rss = pool.apply(cold_rss, (name, nb_traces, nb_samples, noise, seed))
+            correct = int((recovered_key == key).sum())
+            results.append({
+                "engine"         : name,
+                "nb_traces"      : nb_traces,
+                "time_s"         : elapsed,
+                "time_per_trace" : elapsed / nb_traces,
+                "py_heap_mb"     : py_heap / 1e6,
+                "peak_rss_mb"    : rss,
+                "correct_bytes"  : correct,
+                "success"        : correct == KEY_LEN,
+            })
+    pool.close()
+    pool.join()
+    return results
+
+def print_table(results, columns=None):
+    columns = columns or ["engine", "nb_traces", "time_s", "time_per_trace", "py_heap_mb", "peak_rss_mb", "correct_bytes", "success"]
+    formats = {"time_s" : "{:.4f}", "time_per_trace" : "{:.3e}", "py_heap_mb" : "{:.2f}", "peak_rss_mb" : "{:.2f}"}
+    rows = [["-" if r[c] is None else formats.get(c, "{}").format(r[c]) for c in columns] for r in results]
+    widths = [max(len(c), *(len(row[i]) for row in rows)) for i, c in enumerate(columns)]
+
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(v.ljust(w) for v, w in zip(row, widths)))
+
+def save_csv(results, file):
+    columns = list(results[0].keys())
+    with open(file, "w") as f:
+        f.write(",".join(columns) + "\n")
+        for r in results:
+            f.write(",".join(str(r[c]) for c in columns) + "\n")
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description="Benchmark the DPA/CPA attacks on synthetic AES traces")
+    parser.add_argument("-t", "--traces", type=int, nargs="+", default=[50, 100, 200, 500, 1000], help="Trace counts of the grid")
+    parser.add_argument("-e", "--engines", nargs="+", default=list(ENGINES), choices=list(ENGINES), help="Attacks to benchmark")
+    parser.add_argument("-s", "--samples", type=int, default=3000, help="Number of samples per trace")
+    parser.add_argument("-n", "--noise", type=float, default=0.02, help="Standard deviation of the gaussian noise")
+    parser.add_argument("-r", "--repeat", type=int, default=1, help="Runs per measure, the best time is kept")
+    parser.add_argument("--dpa-max-traces", type=int, default=500, help="Largest trace count for the pure python DPA")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic traces")
+    parser.add_argument("--csv", help="Also write the results to this CSV file")
+    args = parser.parse_args()
+
+    results = benchmark(load_engines(args.engines), args.traces, args.samples, args.noise, args.repeat, args.seed, args.dpa_max_traces)
+    print_table(results)
+    if args.csv and results:
+        save_csv(results, args.csv)
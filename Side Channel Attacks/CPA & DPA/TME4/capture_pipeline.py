@@ -0,0 +1,174 @@
+from leakage_windows import leakage_ranges
+from hypothesis import KEY_LEN, SBOX, HW
+from cpa_accumulator import CPAAccumulator
+from database_utils import Database
+from timeit import default_timer as timer
+from collections import namedtuple
+import numpy as np
+import threading
+import argparse
+import queue
+import os
+
+QUEUE_SIZE = 256
+BATCH_SIZE = 50
+
+# Capture and attack at the same time : the capture thread streams the traces through bounded queues (it waits when a
+# consumer is behind) to two consumers :
+#   persister : stores the traces by batches with Database.fill_db (sqlite or trace store)
+#   attacker  : feeds a CPAAccumulator by batches, and stops the capture once the recovered key has been the same for
+#               `stable_batches` batches in a row
+# The traces captured before the stop are all persisted. The first exception of a thread stops the capture and is
+# raised again by capture_and_attack once every thread is done.
+
+# same fields as the traces of cw.capture_trace
+Trace = namedtuple("Trace", ["wave", "textin", "textout", "key"])
+
+# software stand-in for the scope : gaussian noise, plus amplitude * HW(sbox[pt ^ k]) on the leakage range of each key byte
+# (same model as synthetic_traces.generate_traces), capture_trace has the arguments of cw.capture_trace
+
+class SimulatedScope:
+    def __init__(self, nb_samples=3000, noise=0.02, amplitude=0.01, ranges=leakage_ranges, seed=None):
+        self.nb_samples = nb_samples
+        self.noise = noise
+        self.amplitude = amplitude
+        self.ranges = ranges
+        self.rng = np.random.default_rng(seed)
+
+    def capture_trace(self, scope, target, text, key):
+        textin = np.frombuffer(bytes(text), dtype=np.uint8)
+        wave = self.rng.normal(0, self.noise, self.nb_samples)
+        for bnum, (start, end) in enumerate(self.ranges):
+            wave[start:end] += self.amplitude * HW[SBOX[textin[bnum] ^ key[bnum]]]
+        return Trace(wave, bytearray(text), None, bytearray(key))
+
+def capture_worker(capture_trace, scope, target, key, nb_traces, queues, stop, status):
+    try:
+        for _ in range(nb_traces):
+            if stop.is_set():
+                break
+            trace = capture_trace(scope, target, bytearray(os.urandom(KEY_LEN)), key)
+            if trace is None:                                                    # failed capture : skipped
+                continue
+            for q in queues:
+                q.put(trace)
+    except Exception as err:
+        fail(status, err, stop)
+    finally:
+        for q in queues:
+            q.put(None)                                                          # end of the capture
+
+# batches of a queue, until the end of the capture
+def batches(q, batch_size):
+    batch = []
+    while True:
+        trace = q.get()
+        if trace is None:
+            break
+        batch.append(trace)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+# the first exception of the threads is kept in status, and the capture is stopped
+def fail(status, err, stop):
+    with status["lock"]:
+        if status["error"] is None:
+            status["error"] = err
+    stop.set()
+
+# a failing consumer stops the capture and keeps emptying its queue, so the capture thread never blocks on it
+def drain(q):
+    while q.get() is not None:
+        pass
+
+def persist_worker(db, nb_samples, q, batch_size, stop, status):
+    try:
+        for batch in batches(q, batch_size):
+            status["persisted"] += db.fill_db(batch, nb_samples, batch_size, verbose=False)
+    except Exception as err:
+        fail(status, err, stop)
+        drain(q)
+
+def attack_worker(accumulator, q, batch_size, stable_batches, stop, status):
+    previous, stable = None, 0
+    try:
+        for batch in batches(q, batch_size):
+            if stop.is_set():                                                    # the traces captured before the stop
+                continue
+            accumulator.update([trace.wave for trace in batch], [list(trace.textin) for trace in batch])
+            key = accumulator.key()
+            stable = stable + 1 if previous is not None and np.array_equal(key, previous) else 1
+            previous = key
+            status["history"].append((accumulator.nb_traces, key))
+            if stable >= stable_batches:
+                status["stable_after"] = accumulator.nb_traces
+                stop.set()
+    except Exception as err:
+        fail(status, err, stop)
+        drain(q)
+
+# runs the pipeline until nb_traces traces are captured or the key is stable
+#   capture_trace : cw.capture_trace on the real scope, SimulatedScope(...).capture_trace without hardware
+#   db            : Database where the traces are persisted (None : not persisted)
+# returns the recovered key, the number of captured traces and the key after each attacked batch
+# raises the first exception of the capture, persister or attacker thread
+
+def capture_and_attack(capture_trace, scope, target, key, nb_traces, nb_samples=3000, db=None, ranges=leakage_ranges,
+                       batch_size=BATCH_SIZE, stable_batches=3, queue_size=QUEUE_SIZE):
+    stop = threading.Event()
+    status = {"persisted" : 0, "history" : [], "stable_after" : None, "error" : None, "lock" : threading.Lock()}
+    accumulator = CPAAccumulator(nb_samples, ranges)
+    attack_queue = queue.Queue(queue_size)
+    queues = [attack_queue]
+
+    workers = [threading.Thread(target=attack_worker, args=(accumulator, attack_queue, batch_size, stable_batches, stop, status))]
+    if db is not None:
+        persist_queue = queue.Queue(queue_size)
+        queues.append(persist_queue)
+        workers.append(threading.Thread(target=persist_worker, args=(db, nb_samples, persist_queue, batch_size, stop, status)))
+    workers.append(threading.Thread(target=capture_worker, args=(capture_trace, scope, target, bytearray(key), nb_traces, queues, stop, status)))
+
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    if status["error"] is not None:
+        raise status["error"]
+
+    return {
+        "key"          : accumulator.key() if accumulator.nb_traces else None,
+        "attacked"     : accumulator.nb_traces,
+        "persisted"    : status["persisted"],
+        "stable_after" : status["stable_after"],
+        "history"      : status["history"],
+    }
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description="Capture traces with the simulated scope while attacking them")
+    parser.add_argument("-n", "--nb-traces", type=int, default=5000, help="Largest number of traces to capture")
+    parser.add_argument("-s", "--samples", type=int, default=3000, help="Number of samples per trace")
+    parser.add_argument("-b", "--batch-size", type=int, default=BATCH_SIZE, help="Number of traces per batch")
+    parser.add_argument("-k", "--stable-batches", type=int, default=3, help="Stop when the key is the same for this many batches")
+    parser.add_argument("-f", "--file", help="Persist the traces in this database / trace store")
+    parser.add_argument("--backend", choices=["sqlite", "store"], default="store", help="Database backend")
+    parser.add_argument("--noise", type=float, default=0.02, help="Noise of the simulated scope")
+    parser.add_argument("--seed", type=int, help="Seed of the simulated scope")
+    args = parser.parse_args()
+
+    key = bytearray(os.urandom(KEY_LEN))
+    db = None if args.file is None else Database(file=args.file, backend=args.backend)
+    print("[*] Capturing traces with a fixed key: {}".format(list(key)))
+
+    start = timer()
+    result = capture_and_attack(SimulatedScope(args.samples, args.noise, seed=args.seed).capture_trace, None, None, key,
+                                args.nb_traces, args.samples, db, batch_size=args.batch_size, stable_batches=args.stable_batches)
+    end = timer()
+
+    print("[*] Recovered key: {}".format(result["key"].tolist() if result["key"] is not None else None))
+    print("[*] Correct   key: {}".format(list(key)))
+    if result["stable_after"] is not None:
+        print("[*] Key stable after {} traces, capture stopped".format(result["stable_after"]))
+    print("[*] {} traces attacked, {} persisted in {:.3f}s".format(result["attacked"], result["persisted"], end - start))
@@ -295,4 +295,206 @@ void dpa_attack(t_trace *tr, int nb_traces)
     
     printf("Recovered key: ");
     print_array(recovered_key);
-}
\ No newline at end of file
+}
+
+//------------------------------Trace matrix related functions------------------------------------------------------------------
+void mean_dev_columns(double* waves, int nb_traces, int nb_samples, int start, int len, double* means, double* devs) // calculates the mean and the deviation of columns of the matrix
+{
+    double diff;
+
+    init_array(means, len, 0.0);
+    init_array(devs, len, 0.0);
+
+    for (int tnum = 0; tnum < nb_traces; tnum++)                                         // row by row, to read the matrix contiguously
+        add_arrays(means, &waves[(size_t)tnum * nb_samples + start], means, len);
+    for (int i = 0; i < len; i++)
+        means[i] /= nb_traces;
+
+    for (int tnum = 0; tnum < nb_traces; tnum++)                                         // ∑ni=1 (yi - mean(y))^2
+        for (int i = 0; i < len; i++) {
+            diff = waves[(size_t)tnum * nb_samples + start + i] - means[i];
+            devs[i] += diff * diff;
+        }
+}
+
+double corr_coef_matrix(double* waves, uint8_t* textin, uint8_t* hypothesis, int nb_traces, int nb_samples, int guess, int bnum,
+                        int start, int len, double* means, double* devs, double* cov) {   // calculates the correlation coef of a guess
+    double hypothesis_mean = 0.0;
+    double hypothesis_diff;
+    double dev_x = 0.0;
+    double* row;
+
+    if (hypothesis == NULL)
+        for (int tnum = 0; tnum < nb_traces; tnum++)
+            hypothesis_mean += HW[ intermediate(textin[tnum * KEY_SIZE + bnum], guess) ];
+    else
+        for (int tnum = 0; tnum < nb_traces; tnum++)                                     // precomputed hypothesis row of the guess
+            hypothesis_mean += hypothesis[tnum];
+    hypothesis_mean /= nb_traces;
+
+    init_array(cov, len, 0.0);
+    for (int tnum = 0; tnum < nb_traces; tnum++) {
+        hypothesis_diff = (hypothesis == NULL ? HW[ intermediate(textin[tnum * KEY_SIZE + bnum], guess) ] : hypothesis[tnum]) - hypothesis_mean;
+        row = &waves[(size_t)tnum * nb_samples + start];
+        for (int i = 0; i < len; i++)
+            cov[i] += hypothesis_diff * (row[i] - means[i]);                            // COV(X,Y)
+        dev_x += hypothesis_diff * hypothesis_diff;                                      // Deviation(X)
+    }
+
+    for (int i = 0; i < len; i++)
+        cov[i] /= sqrt(dev_x * devs[i]);                                                 // COV(X,Y) /  SQRT( Deviation(X) . Deviation(Y) )
+
+    return max_array(cov, len);
+}
+
+//------------------------------Parallel CPA Attack related functions------------------------------------------------------------------
+double now_seconds()                                                                     // monotonic clock, in seconds
+{
+    struct timespec ts;
+
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+}
+
+void add_stats(t_cpa_job *job, double* field, int bnum, double seconds, int guesses)   // accumulates the timings of a task
+{
+    if (job->stats == NULL)
+        return;
+
+    pthread_mutex_lock(&job->lock);
+    field[bnum] += seconds;
+    job->stats->guesses[bnum] += guesses;
+    pthread_mutex_unlock(&job->lock);
+}
+
+int next_task(t_cpa_job *job)                                                            // returns the next task index of the job, or -1 when done
+{
+    int task;
+
+    pthread_mutex_lock(&job->lock);
+    task = job->next_task < job->nb_tasks ? job->next_task++ : -1;
+    pthread_mutex_unlock(&job->lock);
+
+    return task;
+}
+
+void* stats_worker(void* arg)                                                            // computes the column statistics of the bytes
+{
+    t_cpa_job *job = arg;
+    double start;
+    int bnum;
+
+    while ((bnum = next_task(job)) != -1) {
+        start = now_seconds();
+        mean_dev_columns(job->waves, job->nb_traces, job->nb_samples, job->starts[bnum], job->intervals[bnum],
+                         job->means[bnum], job->devs[bnum]);
+        if (job->stats != NULL)
+            add_stats(job, job->stats->stats_time, bnum, now_seconds() - start, 0);
+    }
+    return NULL;
+}
+
+void* guess_worker(void* arg)                                                            // scores the (byte, guess) pairs
+{
+    t_cpa_job *job = arg;
+    double* cov = malloc(sizeof(double) * job->max_interval);                            // scratch array of the worker, on the heap
+    uint8_t* hypothesis;
+    double start;
+    int task, bnum, guess;
+
+    if (cov == NULL)
+        return (void*) -1;
+
+    while ((task = next_task(job)) != -1) {
+        bnum  = task / 256;
+        guess = task % 256;
+        start = now_seconds();
+        hypothesis = job->hypotheses == NULL ? NULL : &job->hypotheses[(size_t)task * job->nb_traces];   // row (bnum, guess)
+        job->scores[task] = corr_coef_matrix(job->waves, job->textin, hypothesis, job->nb_traces, job->nb_samples, guess, bnum,
+                                             job->starts[bnum], job->intervals[bnum], job->means[bnum], job->devs[bnum], cov);
+        if (job->stats != NULL)
+            add_stats(job, job->stats->guess_time, bnum, now_seconds() - start, 1);
+    }
+
+    free(cov);
+    return NULL;
+}
+
+int run_workers(t_cpa_job *job, void* (*worker)(void*), int nb_tasks, int nb_threads)   // runs a worker on nb_threads threads
+{
+    pthread_t* threads = malloc(sizeof(pthread_t) * nb_threads);
+    void* status;
+    int started = 0;
+    int error = 0;
+
+    if (threads == NULL)
+        return -1;
+
+    job->nb_tasks  = nb_tasks;
+    job->next_task = 0;
+
+    for (; started < nb_threads; started++)
+        if (pthread_create(&threads[started], NULL, worker, job) != 0)
+            break;
+
+    if (started == 0)                                                                    // no thread could be created : do the work here
+        error = worker(job) != NULL;
+
+    for (int i = 0; i < started; i++) {
+        pthread_join(threads[i], &status);
+        error |= status != NULL;
+    }
+
+    free(threads);
+    return error ? -1 : 0;
+}
+
+int cpa_attack_parallel(double* waves, uint8_t* textin, uint8_t* hypotheses, int nb_traces, int nb_samples, int* starts, int* intervals,
+                        int nb_threads, int* recovered_key, double* scores, t_cpa_stats* stats) { // recover all the subkeys using a multithreaded cpa attack
+    t_cpa_job job;
+    double start = now_seconds();
+    int error = 0;
+
+    job.waves        = waves;
+    job.textin       = textin;
+    job.hypotheses   = hypotheses;
+    job.nb_traces    = nb_traces;
+    job.nb_samples   = nb_samples;
+    job.starts       = starts;
+    job.intervals    = intervals;
+    job.scores       = scores;
+    job.max_interval = 0;
+    job.stats        = stats;
+    pthread_mutex_init(&job.lock, NULL);
+
+    if (nb_threads < 1)
+        nb_threads = 1;
+    if (stats != NULL) {
+        bzero(stats, sizeof(t_cpa_stats));
+        stats->nb_threads = nb_threads;
+    }
+
+    for (int bnum = 0; bnum < KEY_SIZE; bnum++) {
+        job.means[bnum] = malloc(sizeof(double) * intervals[bnum]);
+        job.devs[bnum]  = malloc(sizeof(double) * intervals[bnum]);
+        error |= job.means[bnum] == NULL || job.devs[bnum] == NULL;
+        if (intervals[bnum] > job.max_interval)
+            job.max_interval = intervals[bnum];
+    }
+
+    if (!error)
+        error = run_workers(&job, stats_worker, KEY_SIZE, nb_threads);
+    if (!error)
+        error = run_workers(&job, guess_worker, KEY_SIZE * 256, nb_threads);
+
+    for (int bnum = 0; bnum < KEY_SIZE; bnum++) {
+        free(job.means[bnum]);
+        free(job.devs[bnum]);
+        recovered_key[bnum] = error ? -1 : argmax_array(&scores[bnum * 256], 256);       // the correct subkey is the guess that has the maximum correlation
+    }
+
+    pthread_mutex_destroy(&job.lock);
+    if (stats != NULL)
+        stats->total_time = now_seconds() - start;
+    return error ? -1 : 0;
+}
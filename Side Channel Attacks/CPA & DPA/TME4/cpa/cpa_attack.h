@@ -6,6 +6,8 @@
 #include <strings.h>
 #include <math.h>
 #include <stdint.h>
+#include <pthread.h>
+#include <time.h>
 
 #define KEY_SIZE 16
 #define WAVE_SIZE 3000
@@ -112,4 +114,63 @@ int cpa_attack_byte(t_trace *t, int n, int b, int p, int all);          // recov
 void cpa_attack(t_trace *tr, int n, int* i, int all);                   // recover the AES key using CPA attack
 int dpa_attack_byte(t_trace *tr, int n, int b);                          // recover a subkey using DPA attack
 void dpa_attack(t_trace *tr, int n);                                    // recover the AES key using DPA attack
+
+//------------------------------Trace matrix related functions------------------------------------------------------------------
+/*
+The traces can also be given as one contiguous row-major matrix of nb_traces x nb_samples doubles (e.g. a numpy array),
+along with a nb_traces x KEY_SIZE matrix of plain texts. Each key byte is then attacked on the columns
+[ starts[bnum], starts[bnum] + intervals[bnum] [ of the matrix, so no per-trace allocation or copy is needed.
+The attack itself is cpa_attack_parallel below, which returns the key and the scores.
+*/
+void mean_dev_columns(double* w, int n, int s, int st, int l, double* m, double* d);                 // calculates the mean and the deviation of columns of the matrix
+double corr_coef_matrix(double* w, uint8_t* p, uint8_t* h, int n, int s, int g, int b, int st, int l, double* m, double* d, double* c); // calculates the correlation coef of a guess
+
+//------------------------------Parallel CPA Attack related functions------------------------------------------------------------------
+/*
+The parallel attack splits the work in KEY_SIZE x 256 (byte, guess) tasks, taken by nb_threads workers from a shared counter.
+The column statistics of each byte are computed first (one task per byte), then every worker scores guesses with its own
+heap allocated scratch array. The results are written to caller provided buffers :
+  - recovered_key : KEY_SIZE ints
+  - scores        : KEY_SIZE x 256 doubles, the best correlation of each guess
+When stats is not NULL, it receives the timings of the attack (see t_cpa_stats).
+The hypotheses can be precomputed (KEY_SIZE x 256 x nb_traces uint8 HW[ sbox[pt ^ guess] ], see hypothesis.py) or NULL :
+they are then recomputed from the plain texts.
+*/
+typedef struct s_cpa_stats
+{
+  double          stats_time[KEY_SIZE];                 // seconds of the column statistics of each byte
+  double          guess_time[KEY_SIZE];                 // seconds spent scoring the guesses of each byte (summed over the threads)
+  int             guesses[KEY_SIZE];                    // number of guesses scored for each byte
+  double          total_time;                           // wall clock seconds of the attack
+  int             nb_threads;
+
+}  t_cpa_stats;
+
+typedef struct s_cpa_job
+{
+  double*         waves;
+  uint8_t*        textin;
+  uint8_t*        hypotheses;
+  int             nb_traces;
+  int             nb_samples;
+  int*            starts;
+  int*            intervals;
+  double*         means[KEY_SIZE];
+  double*         devs[KEY_SIZE];
+  double*         scores;
+  int             max_interval;
+  int             nb_tasks;
+  int             next_task;
+  pthread_mutex_t lock;
+  t_cpa_stats*    stats;
+
+}  t_cpa_job;
+
+double now_seconds();                                                                                 // monotonic clock, in seconds
+void add_stats(t_cpa_job *j, double* field, int b, double seconds, int guesses);                    // accumulates the timings of a task
+int next_task(t_cpa_job *j);                                                                          // returns the next task index of the job, or -1 when done
+void* stats_worker(void* j);                                                                          // computes the column statistics of the bytes
+void* guess_worker(void* j);                                                                          // scores the (byte, guess) pairs
+int run_workers(t_cpa_job *j, void* (*w)(void*), int nb_tasks, int nb_threads);                      // runs a worker on nb_threads threads
+int cpa_attack_parallel(double* w, uint8_t* p, uint8_t* h, int n, int s, int* st, int* i, int t, int* k, double* c, t_cpa_stats* stats); // recover the AES key using a multithreaded CPA attack
 #endif
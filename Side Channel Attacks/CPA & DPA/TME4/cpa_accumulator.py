@@ -0,0 +1,90 @@
+from cpa_engine import KEY_LEN, hypothesis_matrix
+import numpy as np
+
+# Incremental CPA : https://eprint.iacr.org/2015/260.pdf  (4- Incremental Pearson)
+# The accumulator only keeps the running sums  ∑x, ∑x^2, ∑y, ∑y^2, ∑xy  for every (byte, guess, sample),
+# so its memory is bounded by KEY_LEN * 256 * nb_samples whatever the number of ingested traces.
+#   x : hypothesis HW[ sbox[pt ^ guess] ]
+#   y : trace sample (shifted by the mean of the first batch to keep the sums small)
+
+# correlation of every (guess, sample) from the running sums of n traces : x sums (256,), y sums (nb_samples,), xy (256, nb_samples)
+#   COV(X,Y) / SQRT( Deviation(X) . Deviation(Y) )
+#   COV(X,Y)     = n . ∑ xi . yi - ∑ xi . ∑ yi
+#   Deviation(X) = n . ∑ xi^2 − ( ∑ xi )^2
+def pearson_from_sums(n, sum_x, sum_x2, sum_y, sum_y2, sum_xy):
+    cov   = n * sum_xy - np.outer(sum_x, sum_y)
+    dev_x = n * sum_x2 - sum_x ** 2
+    dev_y = n * sum_y2 - sum_y ** 2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / np.sqrt(np.outer(dev_x, dev_y))
+    return np.nan_to_num(corr, copy=False)
+
+class CPAAccumulator:
+    def __init__(self, nb_samples=3000, leakage_ranges=None):
+        self.nb_samples = nb_samples
+        self.leakage_ranges = leakage_ranges
+        if leakage_ranges is None:
+            self.windows = [(0, nb_samples)] * KEY_LEN         # the whole wave for every byte
+        else:
+            self.windows = list(leakage_ranges)
+
+        self.nb_traces = 0
+        self.offset = None                                     # per sample shift, fixed at the first batch
+        self.sum_x  = np.zeros((KEY_LEN, 256))
+        self.sum_x2 = np.zeros((KEY_LEN, 256))
+        self.sum_y  = [np.zeros(end - start) for start, end in self.windows]
+        self.sum_y2 = [np.zeros(end - start) for start, end in self.windows]
+        self.sum_xy = [np.zeros((256, end - start)) for start, end in self.windows]
+
+    # ingests a batch of traces : waves (nb_traces, nb_samples), pt (nb_traces, KEY_LEN)
+    def update(self, waves, pt):
+        waves = np.asarray(waves, dtype=np.float64)
+        pt = np.asarray(pt, dtype=np.uint8)
+        if len(waves) == 0:
+            return self
+
+        if self.offset is None:
+            self.offset = waves.mean(axis=0)
+
+        for bnum, (start, end) in enumerate(self.windows):
+            y = waves[:, start:end] - self.offset[start:end]
+            x = hypothesis_matrix(pt[:, bnum])                 # (256, nb_traces)
+
+            self.sum_x[bnum]  += x.sum(axis=1)
+            self.sum_x2[bnum] += (x * x).sum(axis=1)
+            self.sum_y[bnum]  += y.sum(axis=0)
+            self.sum_y2[bnum] += (y * y).sum(axis=0)
+            self.sum_xy[bnum] += x @ y
+
+        self.nb_traces += len(waves)
+        return self
+
+    # ingests database_utils.Trace rows
+    def update_from_traces(self, traces):
+        waves, pt = [], []
+        for trace in traces:
+            waves.append(np.frombuffer(trace.wave, dtype=np.float64, count=self.nb_samples))
+            pt.append(np.frombuffer(bytes.fromhex(trace.textin), dtype=np.uint8))
+        return self.update(np.asarray(waves), np.asarray(pt))
+
+    # ingests the DPA_traces/DPA_textin .npy files by batches, without loading them in memory
+    def update_from_npy(self, traces_file, textin_file, batch_size=1000):
+        waves = np.load(traces_file, mmap_mode='r')
+        pt = np.load(textin_file, mmap_mode='r')
+        for i in range(0, len(waves), batch_size):
+            self.update(waves[i:i + batch_size], pt[i:i + batch_size])
+        return self
+
+    # correlation of every (guess, sample) of a byte with the traces ingested so far
+    def correlation(self, bnum):
+        return pearson_from_sums(self.nb_traces, self.sum_x[bnum], self.sum_x2[bnum], self.sum_y[bnum], self.sum_y2[bnum],
+                                 self.sum_xy[bnum])
+
+    # peak absolute correlation of every guess : (KEY_LEN, 256)
+    def peaks(self):
+        return np.array([np.abs(self.correlation(bnum)).max(axis=1) for bnum in range(KEY_LEN)])
+
+    # current best key estimate
+    def key(self):
+        return self.peaks().argmax(axis=1).astype(np.uint8)
@@ -0,0 +1,153 @@
+from ctypes import CDLL, Structure, Union, POINTER, byref, c_int, c_double, c_void_p
+from profiler import NO_PROFILER
+from database_utils import KEY_LEN
+import numpy as np
+import tempfile
+import pathlib
+import sys
+import os
+
+LIB_PATH = pathlib.Path(__file__).absolute().parent / "cpa" / "cpa_attack.so"
+
+# numpy buffers are given to C as plain pointers (no copy), after checking their dtype/shape/layout
+c_double_matrix = np.ctypeslib.ndpointer(dtype=np.float64, ndim=2, flags='C_CONTIGUOUS')
+c_uint8_matrix  = np.ctypeslib.ndpointer(dtype=np.uint8,   ndim=2, flags='C_CONTIGUOUS')
+c_int_array     = np.ctypeslib.ndpointer(dtype=np.intc,    ndim=1, flags='C_CONTIGUOUS')
+c_double_array  = np.ctypeslib.ndpointer(dtype=np.float64, ndim=1, flags='C_CONTIGUOUS')
+
+# t_cpa_stats of cpa_attack.h : timings of cpa_attack_parallel
+class CpaStats(Structure):
+    _fields_ = [("stats_time", c_double * KEY_LEN),
+                ("guess_time", c_double * KEY_LEN),
+                ("guesses", c_int * KEY_LEN),
+                ("total_time", c_double),
+                ("nb_threads", c_int)]
+
+    def to_dict(self):
+        return {"stats_time" : list(self.stats_time), "guess_time" : list(self.guess_time), "guesses" : list(self.guesses),
+                "total_time" : self.total_time, "nb_threads" : self.nb_threads}
+
+# t_trace of cpa_attack.h : one trace of the original cpa_attack, its wave is either the whole wave or one array per window
+class U_WAVE(Union):
+    _fields_ = [("intervals", POINTER(c_double) * KEY_LEN),
+                ("all", POINTER(c_double))]
+
+class TRACE(Structure):
+    _fields_ = [("wave", U_WAVE),
+                ("textin", c_int * KEY_LEN),
+                ("key", c_int * KEY_LEN)]
+
+def load_lib(path=LIB_PATH):
+    lib = CDLL(pathlib.Path(path).absolute().as_posix())
+
+    lib.cpa_attack.argtypes = [POINTER(TRACE), c_int, POINTER(c_int), c_int]
+    lib.cpa_attack.restype = None
+
+    lib.cpa_attack_parallel.argtypes = [c_double_matrix, c_uint8_matrix, c_void_p, c_int, c_int, c_int_array, c_int_array,
+                                        c_int, c_int_array, c_double_array, POINTER(CpaStats)]
+    lib.cpa_attack_parallel.restype = c_int
+
+    return lib
+
+# columns of the wave to keep, and the (start, length) of each key byte window inside the kept columns
+#   leakage_ranges = None : the whole wave is shared by all the key bytes
+
+def windows_layout(leakage_ranges, nb_samples):
+    if leakage_ranges is None:
+        starts    = np.zeros(KEY_LEN, dtype=np.intc)
+        intervals = np.full(KEY_LEN, nb_samples, dtype=np.intc)
+        return None, starts, intervals
+
+    intervals = np.asarray([end - start for start, end in leakage_ranges], dtype=np.intc)
+    starts    = np.concatenate(([0], np.cumsum(intervals)[:-1])).astype(np.intc)
+    columns   = np.concatenate([np.arange(start, end) for start, end in leakage_ranges])
+    return columns, starts, intervals
+
+# loads Trace rows into one contiguous row-major matrix (only the kept columns) and the textin/key matrices
+
+def load_traces(traces_from_db, nb_samples, columns=None, profiler=NO_PROFILER):
+    with profiler.timer("db_query"):
+        rows = list(traces_from_db)
+    nb_columns = nb_samples if columns is None else len(columns)
+
+    waves  = np.empty((len(rows), nb_columns), dtype=np.float64)
+    textin = np.empty((len(rows), KEY_LEN), dtype=np.uint8)
+    keys   = np.empty((len(rows), KEY_LEN), dtype=np.uint8)
+
+    with profiler.timer("blob_decode"):
+        for i, trace in enumerate(rows):
+            wave = np.frombuffer(trace.wave, dtype=np.float64, count=nb_samples)   # view on the blob, no unpacking
+            waves[i]  = wave if columns is None else wave[columns]
+            textin[i] = np.frombuffer(bytes.fromhex(trace.textin), dtype=np.uint8)
+            keys[i]   = np.frombuffer(bytes.fromhex(trace.key), dtype=np.uint8)
+    profiler.count("traces_loaded", len(rows))
+    profiler.count("bytes_decoded", len(rows) * nb_samples * 8)
+
+    with profiler.timer("rounding"):
+        np.round(waves, 8, out=waves)                                         # same precision as the samples used so far
+    return waves, textin, keys
+
+# multithreaded attack : returns the recovered key (KEY_LEN,) and the best correlation of each guess (KEY_LEN, 256)
+#   hypotheses : precomputed (KEY_LEN, 256, nb_traces) HW matrices (hypothesis.hypotheses), or None to compute them in C
+#   stats      : CpaStats filled with the per byte timings and guess counts, or None
+
+def cpa_attack_parallel(lib, waves, textin, starts, intervals, nb_threads=None, hypotheses=None, stats=None):
+    recovered_key = np.zeros(KEY_LEN, dtype=np.intc)
+    scores = np.zeros(KEY_LEN * 256, dtype=np.float64)
+
+    # C reads the buffers with these shapes : a mismatch would read out of them
+    if textin.shape != (waves.shape[0], KEY_LEN):
+        raise ValueError("textin has shape {}, expected {}".format(textin.shape, (waves.shape[0], KEY_LEN)))
+    if len(starts) != KEY_LEN or len(intervals) != KEY_LEN or (starts < 0).any() or (starts + intervals > waves.shape[1]).any():
+        raise ValueError("the windows do not fit in the {} columns of the waves".format(waves.shape[1]))
+    if hypotheses is not None:
+        hypotheses = np.ascontiguousarray(hypotheses, dtype=np.uint8)         # a read only memory map is given as is
+        if hypotheses.shape != (KEY_LEN, 256, waves.shape[0]):
+            raise ValueError("hypotheses have shape {}, expected {}".format(hypotheses.shape, (KEY_LEN, 256, waves.shape[0])))
+
+    if lib.cpa_attack_parallel(waves, textin, None if hypotheses is None else hypotheses.ctypes.data, waves.shape[0], waves.shape[1], starts, intervals,
+                               nb_threads or os.cpu_count() or 1, recovered_key, scores, None if stats is None else byref(stats)) != 0:
+        raise MemoryError("cpa_attack_parallel could not allocate its buffers or threads")
+
+    return recovered_key, scores.reshape(KEY_LEN, 256)
+
+# t_trace array of the original cpa_attack, the waves point into the numpy buffers (kept alive by the returned windows)
+#   leakage_ranges = None : the whole wave for every key byte
+# returns the traces, the interval of each key byte and the numpy arrays the traces point to
+
+def c_traces(waves, textin, leakage_ranges=None):
+    if leakage_ranges is None:
+        windows = [np.ascontiguousarray(waves, dtype=np.float64)]
+        intervals = [waves.shape[1]] * KEY_LEN
+    else:
+        windows = [np.ascontiguousarray(waves[:, start:end], dtype=np.float64) for start, end in leakage_ranges]
+        intervals = [end - start for start, end in leakage_ranges]
+
+    traces = (TRACE * len(waves))()
+    pointers = [[w[t].ctypes.data_as(POINTER(c_double)) for w in windows] for t in range(len(waves))]
+    for t, trace in enumerate(traces):
+        if leakage_ranges is None:
+            trace.wave.all = pointers[t][0]
+        else:
+            trace.wave.intervals[:] = pointers[t]
+        trace.textin[:] = [int(b) for b in textin[t]]
+    return traces, (c_int * KEY_LEN)(*intervals), windows
+
+# original single threaded attack : cpa_attack only prints the recovered key, so its stdout is read back
+def cpa_attack_traces(lib, traces, intervals, all_wave=False):
+    libc = CDLL(None)
+    sys.stdout.flush()
+    with tempfile.TemporaryFile() as output:
+        saved = os.dup(1)
+        os.dup2(output.fileno(), 1)
+        try:
+            lib.cpa_attack(traces, len(traces), intervals, int(all_wave))
+            libc.fflush(None)
+        finally:
+            os.dup2(saved, 1)
+            os.close(saved)
+        output.seek(0)
+        printed = output.read().decode()
+
+    line = [l for l in printed.splitlines() if l.startswith("Recovered key:")][-1]
+    return np.asarray(line.split(":")[1].split(), dtype=np.intc)
@@ -0,0 +1,60 @@
+from hypothesis import KEY_LEN, SBOX, HW, GUESSES
+import numpy as np
+
+# hypothesis matrix of one key byte : HW[ sbox[pt ^ guess] ] for all the 256 guesses and all the traces -> shape (256, nb_traces)
+
+def hypothesis_matrix(pt_byte):
+    return HW[SBOX[np.bitwise_xor.outer(GUESSES, np.asarray(pt_byte, dtype=np.uint8))]]
+
+# centers the samples once : the trace statistics do not depend on the guess
+
+def center_samples(samples):
+    y = np.asarray(samples, dtype=np.float64)
+    y = y - y.mean(axis=0)                                            # centered samples        (nb_traces, nb_samples)
+    return y, (y * y).sum(axis=0)
+
+# Pearson correlation between every hypothesis row and every centered sample column, computed as a single matrix product
+#   corr[g, s] = ∑ (h[g] - mean(h[g])) . (y[s] - mean(y[s])) / SQRT( ∑ (h[g] - mean(h[g]))^2 . ∑ (y[s] - mean(y[s]))^2 )
+
+def corr_matrix(hypothesis, y, y_sq):
+    h = hypothesis - hypothesis.mean(axis=1, keepdims=True)          # centered hypothesis     (256, nb_traces)
+
+    cov = h @ y                                                       # covariance for all (guess, sample) pairs
+    std = np.sqrt(np.outer((h * h).sum(axis=1), y_sq))                # product of the standard deviations
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = cov / std
+    return np.nan_to_num(corr, copy=False)                           # constant samples/hypothesis have no correlation
+
+def cpa_attack_byte(y, y_sq, pt_byte, hypothesis=None):
+    if hypothesis is None:
+        hypothesis = hypothesis_matrix(pt_byte)
+    corr = corr_matrix(np.asarray(hypothesis, dtype=np.float64), y, y_sq)
+    peaks = np.abs(corr).max(axis=1)                                  # best correlation of every guess over the samples
+    return int(peaks.argmax()), peaks
+
+# recover the AES key using CPA attack
+#   waves          : (nb_traces, nb_samples) trace matrix
+#   pt             : (nb_traces, KEY_LEN) plain texts
+#   leakage_ranges : list of KEY_LEN (start, end) windows, or None to use the whole wave for every byte
+#   hypotheses     : precomputed (KEY_LEN, 256, nb_traces) HW matrices of the plain texts (hypothesis.hypotheses), or None
+# returns the recovered key (KEY_LEN,) and the peak correlation of every guess (KEY_LEN, 256)
+
+def cpa_attack(waves, pt, leakage_ranges=None, hypotheses=None):
+    waves = np.asarray(waves)
+    pt = np.asarray(pt, dtype=np.uint8)
+
+    recovered_key = np.zeros(KEY_LEN, dtype=np.uint8)
+    peaks = np.zeros((KEY_LEN, 256))
+
+    if leakage_ranges is None:
+        y, y_sq = center_samples(waves)                               # the whole wave is shared by all the key bytes
+
+    for bnum in range(KEY_LEN):
+        if leakage_ranges is not None:
+            start, end = leakage_ranges[bnum]
+            y, y_sq = center_samples(waves[:, start:end])
+        hypothesis = None if hypotheses is None else hypotheses[bnum]
+        recovered_key[bnum], peaks[bnum] = cpa_attack_byte(y, y_sq, pt[:, bnum], hypothesis)
+
+    return recovered_key, peaks
@@ -1,7 +1,21 @@
-from peewee import Model, CharField, BlobField, SqliteDatabase, DatabaseProxy
-import struct
+from peewee import Model, CharField, BlobField, SqliteDatabase, DatabaseProxy, chunked
+from timeit import default_timer as timer
+from trace_store import TraceStore, ENCODINGS
+from profiler import NO_PROFILER
+from itertools import islice
+import numpy as np
 
 KEY_LEN = 16
+BATCH_SIZE = 1000
+ROWS_PER_INSERT = 300            # 3 columns per row : stays under the 999 variables limit of old SQLite versions
+
+# WAL journal + relaxed synchronous mode : the commits of the bulk inserts do not wait for a fsync
+SQLITE_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'cache_size': -64 * 1024,       # 64 MB page cache
+    'temp_store': 'memory',
+}
 
 database = DatabaseProxy()
 
@@ -13,16 +27,103 @@ class Trace(Model):
     class Meta:
         database = database
 
+# two backends :
+#   "sqlite" : one Trace row per trace, the wave is a float64 blob
+#   "store"  : trace_store.TraceStore directory, column oriented and memory mapped (encoding : float64, or the lossy float32 and int16)
+
 class Database:
-    def __init__(self, file='traces.db'):
-        self.db = SqliteDatabase(file)
-        database.initialize(self.db)
+    def __init__(self, file='traces.db', backend="sqlite", encoding="float64"):
+        self.backend = backend
+        if backend == "store":
+            self.store = TraceStore(file, encoding)
+        elif backend == "sqlite":
+            self.db = SqliteDatabase(file, pragmas=SQLITE_PRAGMAS)
+            database.initialize(self.db)
+        else:
+            raise ValueError("Unknown backend: {}".format(backend))
 
-    def fill_db(self, traces, nb_samples):
+    # inserts the traces by batches of batch_size rows, each batch inside its own transaction
+    # the waves are serialized directly from their buffer (same layout as struct.pack('d' * nb_samples))
+    def fill_db(self, traces, nb_samples, batch_size=BATCH_SIZE, verbose=True):
+        if self.backend == "store":
+            return self.fill_store(traces, nb_samples, batch_size, verbose)
         self.db.create_tables([Trace])
-        for wave, textin, _, key in traces:
-            trace = Trace.create(
-                    key    = key.hex(),
-                    textin = textin.hex(),
-                    wave   = struct.pack('d' * nb_samples, *wave))
-            trace.save()
+
+        rows = ({
+                    'key'    : bytes(key).hex(),
+                    'textin' : bytes(textin).hex(),
+                    'wave'   : np.ascontiguousarray(wave[:nb_samples], dtype=np.float64).tobytes()
+                } for wave, textin, _, key in traces)
+
+        nb_traces = 0
+        start = timer()
+        while True:
+            batch = list(islice(rows, batch_size))
+            if not batch:
+                break
+            with self.db.atomic():
+                for rows_chunk in chunked(batch, ROWS_PER_INSERT):
+                    Trace.insert_many(rows_chunk).execute()
+            nb_traces += len(batch)
+        elapsed = timer() - start
+
+        if verbose and nb_traces:
+            print("[*] Inserted {} traces in {:.3f}s ({:.0f} traces/s, {:.2f} MB/s)".format(
+                  nb_traces, elapsed, nb_traces / elapsed, nb_traces * nb_samples * 8 / elapsed / 1e6))
+        return nb_traces
+
+    def fill_store(self, traces, nb_samples, batch_size=BATCH_SIZE, verbose=True):
+        traces = iter(traces)
+        nb_traces = 0
+        start = timer()
+        while True:
+            batch = list(islice(traces, batch_size))
+            if not batch:
+                break
+            self.store.append([np.asarray(wave[:nb_samples], dtype=np.float64) for wave, _, _, _ in batch],
+                              [list(textin) for _, textin, _, _ in batch], [list(key) for _, _, _, key in batch])
+            nb_traces += len(batch)
+        elapsed = timer() - start
+
+        if verbose and nb_traces:
+            print("[*] Stored {} traces in {:.3f}s ({:.0f} traces/s)".format(nb_traces, elapsed, nb_traces / elapsed))
+        return nb_traces
+
+    # keyset pagination of the Trace table : pages of at most page_size rows with an id above after_id,
+    # the cost of a page does not depend on its position (unlike OFFSET)
+    def pages(self, page_size=BATCH_SIZE, after_id=0):
+        while True:
+            rows = list(Trace.select().where(Trace.id > after_id).order_by(Trace.id).limit(page_size))
+            if not rows:
+                break
+            after_id = rows[-1].id
+            yield rows
+
+    # windows in samples of the captured waves -> windows in samples of the database : they are divided for a decimated
+    # store (preprocessing.py). The layout of the loaded columns (cpa_bridge.windows_layout) is built from these.
+    def decimation(self):
+        return self.store.meta.get("preprocessing", {}).get("params", {}).get("factor", 1) if self.backend == "store" else 1
+
+    def sample_ranges(self, leakage_ranges):
+        if leakage_ranges is None or self.decimation() <= 1:
+            return leakage_ranges
+        from preprocessing import decimate_ranges
+        return decimate_ranges(leakage_ranges, self.decimation())
+
+    def sample_points(self, leakage_points):
+        return [point // self.decimation() for point in leakage_points]
+
+    # nb_traces traces from the offset-th one : waves (n, nb_columns), textin, keys
+    #   leakage_ranges : only the samples of these windows, concatenated (layout of cpa_bridge.windows_layout),
+    #                    in samples of the database (see sample_ranges)
+    def load(self, nb_traces, offset=0, nb_samples=3000, leakage_ranges=None, profiler=NO_PROFILER):
+        if self.backend == "store":
+            with profiler.timer("store_read"):
+                waves, textin, keys = self.store.read(offset, offset + nb_traces, leakage_ranges)
+            profiler.count("traces_loaded", len(waves))
+            profiler.count("bytes_decoded", waves.size * np.dtype(ENCODINGS[self.store.meta["encoding"]]).itemsize)
+            return waves, textin, keys
+
+        from cpa_bridge import load_traces, windows_layout
+        columns = windows_layout(leakage_ranges, nb_samples)[0]
+        return load_traces(Trace.select().order_by(Trace.id).limit(nb_traces).offset(offset), nb_samples, columns, profiler)
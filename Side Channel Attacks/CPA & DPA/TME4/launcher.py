@@ -1,29 +1,31 @@
 
-from ctypes import Structure, c_int, CDLL, c_double, POINTER, Union
-from database_utils import Database, Trace, KEY_LEN
+from cpa_bridge import load_lib, windows_layout, cpa_attack_parallel, CpaStats
+from database_utils import Database, KEY_LEN
+from leakage_assessment import cached_assess
+from leakage_windows import leakage_ranges as default_leakage_ranges
+from hypothesis import hypotheses
+from profiler import Profiler
 from timeit import default_timer as timer
 from datetime import timedelta
+import numpy as np
 import pathlib
-import struct
 import sys
-import os
-
-DOUBLE_SIZE = 8
 
 # user controlled parameters
 db_file = "traces.db"
+backend = "sqlite"           # "store" : db_file is a trace_store.py directory, only the leakage ranges are read from the disk
 new_capture = False
 nb_samples = 3000
 nb_traces = 50
 traces_start_offset = 0
 use_all_wave = False
+nb_threads = None            # None : one worker per core
+auto_leakage = False         # find the leakage ranges of the selected traces (NICV) instead of using the ones below
+known_key_leakage = False    # auto_leakage with the correct key (HW classes) : profiling only, the attack is no longer blind
+hypothesis_cache = False     # reuse the HW[ sbox[pt ^ guess] ] matrices of these plain texts (hypothesis_cache/, 4 KB per trace)
+profile_file = "launcher_profile.json"   # JSON report of the timers/counters of the run, None : no report
 
-leakage_ranges = [ \
-    (1505 , 1510), (1755 , 1765), (2005 , 2015), (2254 , 2278), 
-    (1561 , 1565), (1805 , 1820), (2060 , 2075), (2314 , 2326),
-    (1615 , 1625), (1865 , 1878), (2120 , 2130), (2370 , 2384), 
-    (1670 , 1680), (1920 , 1934), (2175 , 2185), (2425 , 2435)  
-]
+leakage_ranges = default_leakage_ranges   # one (start, end) window per key byte, see leakage_windows.py
 
 # store traces on the database
     
@@ -41,112 +43,66 @@ if new_capture:
          3.1- Execute the cell""")
     sys.exit(0)
     
-db  = Database(file=db_file)
-
-# perform a query which selects args.number_of_traces traces starting from args.traces_start_offset offset
-traces_from_db = Trace.select().limit(nb_traces).offset(traces_start_offset)
-
+profiler = Profiler()
+db  = Database(file=db_file, backend=backend)
 
 # load C lib
 try:
-    lib = CDLL(pathlib.Path("cpa/cpa_attack.so").absolute().as_posix())
+    with profiler.timer("load_lib"):
+        lib = load_lib()
 except OSError as err:
     print("Make sure that `make` command was performed and the library was created. \nError : {}".format(err))
-
-# define Ctype structure that matches the Python trace 
-
-class U_WAVE(Union):
-    _fields_ = [
-        ("intervals", POINTER(c_double) * KEY_LEN),
-        ("all", POINTER(c_double)),
-    ]      
-
-class TRACE(Structure):
-    _fields_ = [
-        ("wave", U_WAVE),
-        ("textin", c_int * KEY_LEN),
-        ("key", c_int * KEY_LEN)
-    ]
-
-# defining python pointers to C functions
-
-if use_all_wave :
-    intervals = [nb_samples] * KEY_LEN
-    c_intervals = (c_int * KEY_LEN)(*intervals) 
-    
-    init_wave = lib.init_wave                            # python pointer to the C init_wave function 
-    init_wave.restype = U_WAVE
-
-    fill_wave = lib.fill_wave                             # python pointer to the C fill_wave function 
-    fill_wave.restype = None
-
-else :
-    intervals = [ (end - start) for start, end in leakage_ranges]  # calculating the nb_samples for each interval
-    c_intervals = (c_int * KEY_LEN)(*intervals)                    # convert it to C int array
-
-    init_intervals = lib.init_intervals                            # python pointer to the C init_intervals function 
-    init_intervals.restype = U_WAVE
-
-    fill_intervals = lib.fill_intervals                             # python pointer to the C fill_intervals function 
-    fill_intervals.restype = None
-
-# creates a C wave from a binary wave stored in the db 
-
-def handle_wave(nb_samples):
-    wave = init_wave(nb_samples)
-    wave_bin = struct.unpack_from("d" * nb_samples, trace.wave, 0 * DOUBLE_SIZE)  
-    wave_bin = [round(x, 8) for x in wave_bin]
-    fill_wave(wave, (c_double * nb_samples)(*wave_bin), nb_samples)
-    return wave
-
-def handle_intervals(c_intervals):
-    
-    wave = init_intervals(c_intervals)                         # allocate memory for all the intervals
-    
-    for i in range(len(leakage_ranges)):
-        start, end = leakage_ranges[i]
-        wave_bin = struct.unpack_from("d" * intervals[i], trace.wave, start * DOUBLE_SIZE)  
-        wave_bin = [round(x, 8) for x in wave_bin]            # convert the packed data inside the db to samples
-        fill_intervals(wave, i, (c_double * intervals[i])(*wave_bin), intervals[i])   # fill the wave structure
-    
-    return wave
-
-# Create a list of C traces
-traces = []
-
-for trace in traces_from_db:                                  # create Traces in C from the Traces in the db
-    if use_all_wave :
-        wave = handle_wave(nb_samples)                               # create a wave 
-    else :
-        wave = handle_intervals(c_intervals)                         # create a wave intervals              
-    correct_key = list(bytearray.fromhex(trace.key))
-    traces.append(TRACE(
-        wave,
-        (c_int * KEY_LEN)(*list(bytearray.fromhex(trace.textin))),   # convert from Python Array to C Array
-        (c_int * KEY_LEN)(*list(bytearray.fromhex(trace.key))),      # convert from Python Array to C Array
-    ))
-        
-traces = (TRACE * nb_traces)(*traces)
+    sys.exit(-1)
+
+# load the traces as one contiguous matrix : the C library reads the numpy buffers directly
+#   use_all_wave : the whole wave for every key byte
+#   otherwise    : only the leakage ranges are kept, one after another, and each key byte reads its own columns
+
+#   auto_leakage : the whole waves are loaded once to find the leakage ranges (cached per dataset), then only those are kept.
+#                  The classes are the plain text bytes (no key needed, a few thousand traces), or the HW classes of the
+#                  correct key with known_key_leakage (a few dozen traces, but the key is used to find the windows)
+
+if auto_leakage and not use_all_wave:
+    with profiler.timer("load_traces"):
+        waves, textin, keys = db.load(nb_traces, traces_start_offset, nb_samples, profiler=profiler)
+    dataset_id = "{}:{}:{}:{}".format(pathlib.Path(db_file).absolute(), pathlib.Path(db_file).stat().st_mtime, traces_start_offset, len(waves))
+    with profiler.timer("leakage_assessment"):
+        if known_key_leakage:
+            leakage_ranges = cached_assess(waves, textin, key=keys[0], model="hw", dataset_id=dataset_id,
+                                           hypotheses=hypotheses(textin, "HW") if hypothesis_cache else None)["leakage_ranges"]
+        else:
+            leakage_ranges = cached_assess(waves, textin, dataset_id=dataset_id)["leakage_ranges"]
+    print("Leakage ranges: {}".format(leakage_ranges))
+    columns, starts, intervals = windows_layout(leakage_ranges, nb_samples)
+    with profiler.timer("contiguous_copy"):
+        waves = np.ascontiguousarray(waves[:, columns])
+else:
+    leakage_ranges = db.sample_ranges(leakage_ranges)      # windows of a decimated trace store
+    columns, starts, intervals = windows_layout(None if use_all_wave else leakage_ranges, nb_samples)
+    with profiler.timer("load_traces"):
+        waves, textin, keys = db.load(nb_traces, traces_start_offset, nb_samples, None if use_all_wave else leakage_ranges, profiler)
+correct_key = keys[-1]
 
 # call the function that performs the attack
 
-if use_all_wave :
-    start = timer()
-    lib.cpa_attack(traces, nb_traces, c_intervals, 1)
-    #lib.dpa_attack(traces, nb_traces)
-    end   = timer()
-else :
-    start = timer()
-    lib.cpa_attack(traces, nb_traces, c_intervals, 0)
-    end   = timer()
+start = timer()
+with profiler.timer("hypotheses"):
+    hypotheses_matrix = hypotheses(textin, "HW") if hypothesis_cache else None
+stats = CpaStats()
+with profiler.timer("attack"):
+    recovered_key, scores = cpa_attack_parallel(lib, waves, textin, starts, intervals, nb_threads, hypotheses_matrix, stats)
+end   = timer()
 
-for t in traces :                           # free our allocated memroy
-    if use_all_wave :
-        lib.free_wave(t.wave)
-    else :
-        lib.free_intervals(t.wave)
-        
-print("Correct   key: ", end='')
+print("Recovered key: ", end='')
+for i in range(KEY_LEN): print(recovered_key[i],end=' ')
+
+print("\nCorrect   key: ", end='')
 for i in range(KEY_LEN): print(correct_key[i],end=' ')
 
 print("\nThe attack took:  {}".format(timedelta(seconds=end-start)))
+
+if profile_file is not None:
+    profiler.save(profile_file, traces_per_second=profiler.rate("traces_loaded", "load_traces"), c_attack=stats.to_dict(),
+                  nb_traces=len(waves), key_recovered=bool((recovered_key == correct_key).all()),
+                  known_key_leakage=bool(auto_leakage and known_key_leakage))
+    print("Profile saved to: {}".format(profile_file))
@@ -0,0 +1,165 @@
+from hypothesis import KEY_LEN, SBOX, HW, hypotheses
+from database_utils import Database
+import numpy as np
+import argparse
+import hashlib
+import pathlib
+import json
+
+CACHE_DIR = "leakage_cache"
+CHUNK_SIZE = 4096
+
+# Leakage assessment : which samples depend on the processed key byte ?
+#   NICV = Var( E[X|C] ) / Var(X)                     https://eprint.iacr.org/2013/717.pdf
+#   SNR  = Var( E[X|C] ) / E[ Var(X|C) ]  = NICV / (1 - NICV)   (law of total variance)
+# The class C of a trace is the sbox output sbox[pt ^ k] of the byte. With a fixed key it is a bijection of the plain text
+# byte, so the plain text byte gives the same partition and no key is needed.
+# With 256 classes the metrics need a few thousand traces : when the key is known, the 9 classes HW(sbox[pt ^ k])
+# (model="hw") give usable windows from a few dozen traces.
+# With the key, the labels are the key columns of the hypothesis matrices when they are given (hypothesis.hypotheses,
+# "HW" model for model="hw", "ID" model otherwise) : the cached matrices of the attack are reused.
+
+def class_labels(textin, key=None, model="value", hypotheses=None):
+    textin = np.asarray(textin, dtype=np.uint8)
+    if key is None:
+        return textin
+    if hypotheses is not None:
+        return np.asarray(hypotheses[np.arange(KEY_LEN), np.asarray(key, dtype=np.uint8)]).T
+    labels = SBOX[textin ^ np.asarray(key, dtype=np.uint8)]
+    return HW.astype(np.uint8)[labels] if model == "hw" else labels
+
+# one pass over the trace matrix, by chunks : per class counts and sums of the 16 bytes, and the overall sums
+
+def class_statistics(waves, labels, chunk_size=CHUNK_SIZE):
+    nb_samples = waves.shape[1]
+    counts = np.zeros((KEY_LEN, 256))
+    sums   = np.zeros((KEY_LEN, 256, nb_samples))
+    sum_x  = np.zeros(nb_samples)
+    sum_x2 = np.zeros(nb_samples)
+    classes = np.arange(256)[:, None]
+
+    for i in range(0, len(waves), chunk_size):
+        x = np.asarray(waves[i:i + chunk_size], dtype=np.float64)
+        sum_x  += x.sum(axis=0)
+        sum_x2 += (x * x).sum(axis=0)
+        for bnum in range(KEY_LEN):
+            one_hot = (labels[i:i + chunk_size, bnum] == classes).astype(np.float64)   # (256, chunk)
+            counts[bnum] += one_hot.sum(axis=1)
+            sums[bnum]   += one_hot @ x
+
+    return counts, sums, sum_x, sum_x2
+
+def nicv_snr(waves, textin, key=None, model="value", chunk_size=CHUNK_SIZE, hypotheses=None):
+    n = len(waves)
+    counts, sums, sum_x, sum_x2 = class_statistics(waves, class_labels(textin, key, model, hypotheses), chunk_size)
+
+    mean = sum_x / n
+    var  = sum_x2 / n - mean ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        class_means = np.where(counts[..., None] > 0, sums / counts[..., None], mean)
+        inter_var = (counts[..., None] * (class_means - mean) ** 2).sum(axis=1) / n       # Var( E[X|C] ) : (KEY_LEN, nb_samples)
+        nicv = np.nan_to_num(inter_var / var)
+        snr  = np.nan_to_num(inter_var / (var - inter_var), posinf=0.0)
+    return nicv, snr
+
+# fixed-vs-random Welch t-test : fixed is a boolean array telling which traces use the fixed plain text
+# the result does not depend on the key byte, it is given for every byte
+
+def welch_ttest(waves, fixed):
+    fixed = np.asarray(fixed, dtype=bool)
+    a, b = waves[fixed], waves[~fixed]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t = (a.mean(axis=0) - b.mean(axis=0)) / np.sqrt(a.var(axis=0, ddof=1) / len(a) + b.var(axis=0, ddof=1) / len(b))
+    return np.tile(np.abs(np.nan_to_num(t)), (KEY_LEN, 1))
+
+# the nb_windows best windows of a score : around each peak, the contiguous samples above ratio * peak (at most max_width)
+# the score is taken above its median, which is the estimation bias of the metric on the non leaking samples
+
+def top_windows(score, nb_windows=1, ratio=0.5, max_width=32):
+    score = np.array(score, dtype=np.float64)
+    score = np.clip(score - np.median(score), 0, None)
+    windows = []
+    for _ in range(nb_windows):
+        peak = int(score.argmax())
+        if score[peak] <= 0:
+            break
+        start, end = peak, peak + 1
+        while start > 0 and end - start < max_width and score[start - 1] >= ratio * score[peak]:
+            start -= 1
+        while end < len(score) and end - start < max_width and score[end] >= ratio * score[peak]:
+            end += 1
+        windows.append((start, end))
+        score[max(0, start - max_width):end + max_width] = 0                                 # the next window is another peak
+    return windows
+
+# assessment of a dataset, in the format of launcher.py (leakage_ranges) and of DPA_Attack (leakage_points, ranges)
+
+def assess(waves, textin, metric="nicv", key=None, model="value", fixed=None, nb_windows=1, ratio=0.5, max_width=32,
+           hypotheses=None):
+    if metric == "ttest":
+        scores = welch_ttest(waves, fixed)
+    else:
+        nicv, snr = nicv_snr(waves, textin, key, model, hypotheses=hypotheses)
+        scores = nicv if metric == "nicv" else snr
+
+    windows = [top_windows(scores[bnum], nb_windows, ratio, max_width) for bnum in range(KEY_LEN)]
+    return {
+        "metric"         : metric,
+        "windows"        : windows,                                                           # the nb_windows best windows per byte
+        "leakage_ranges" : [w[0] if w else (0, waves.shape[1]) for w in windows],             # the best one, as (start, end)
+        "leakage_points" : [int(scores[bnum].argmax()) for bnum in range(KEY_LEN)],
+    }
+
+def dpa_leakage(result):
+    return result["leakage_points"], [range(start, end) for start, end in result["leakage_ranges"]]
+
+# the assessment is cached per dataset : by default the dataset is identified by a hash of its traces and plain texts
+
+def dataset_digest(waves, textin, params):
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode())
+    digest.update(np.ascontiguousarray(textin).tobytes())
+    for i in range(0, len(waves), CHUNK_SIZE):
+        digest.update(np.ascontiguousarray(waves[i:i + CHUNK_SIZE]).tobytes())
+    return digest.hexdigest()
+
+def cached_assess(waves, textin, metric="nicv", key=None, model="value", fixed=None, nb_windows=1, ratio=0.5, max_width=32,
+                  cache_dir=CACHE_DIR, dataset_id=None, hypotheses=None):
+    params = {"metric" : metric, "nb_windows" : nb_windows, "ratio" : ratio, "max_width" : max_width, "model" : model,
+              "key" : None if key is None else bytes(key).hex(), "dataset" : dataset_id}
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest() if dataset_id else \
+             dataset_digest(waves, textin, params)
+    cache_file = pathlib.Path(cache_dir) / "{}.json".format(digest)
+
+    if cache_file.exists():
+        result = json.loads(cache_file.read_text())
+    else:
+        result = assess(waves, textin, metric, key, model, fixed, nb_windows, ratio, max_width, hypotheses)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps(result))
+
+    result["leakage_ranges"] = [tuple(w) for w in result["leakage_ranges"]]
+    result["windows"] = [[tuple(w) for w in windows] for windows in result["windows"]]
+    return result
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description="Find the leakage windows of each key byte of a trace database")
+    parser.add_argument("-f", "--file", default="traces.db", help="Trace database")
+    parser.add_argument("--backend", choices=["sqlite", "store"], default="sqlite", help="Database backend")
+    parser.add_argument("-n", "--nb-traces", type=int, default=1000, help="Number of traces used for the assessment")
+    parser.add_argument("--offset", type=int, default=0, help="Offset of the first trace in the database")
+    parser.add_argument("-s", "--samples", type=int, default=3000, help="Number of samples per trace")
+    parser.add_argument("-m", "--metric", choices=["nicv", "snr"], default="nicv", help="Leakage metric")
+    parser.add_argument("-k", "--known-key", action="store_true", help="Use the HW of the sbox output with the stored key as classes")
+    parser.add_argument("--hypothesis-cache", action="store_true", help="With --known-key, take the classes from the cached hypothesis matrices")
+    parser.add_argument("-w", "--windows", type=int, default=1, help="Number of windows per byte")
+    parser.add_argument("--max-width", type=int, default=32, help="Largest window width")
+    args = parser.parse_args()
+
+    waves, textin, keys = Database(file=args.file, backend=args.backend).load(args.nb_traces, args.offset, args.samples)
+    result = cached_assess(waves, textin, args.metric, keys[0] if args.known_key else None, "hw" if args.known_key else "value",
+                           nb_windows=args.windows, max_width=args.max_width,
+                           hypotheses=hypotheses(textin, "HW") if args.known_key and args.hypothesis_cache else None,
+                           dataset_id="{}:{}:{}:{}".format(pathlib.Path(args.file).absolute(), pathlib.Path(args.file).stat().st_mtime, args.offset, len(waves)))
+
+    print("leakage_points = {}".format(result["leakage_points"]))
+    print("leakage_ranges = {}".format(result["leakage_ranges"]))
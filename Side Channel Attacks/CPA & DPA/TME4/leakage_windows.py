@@ -0,0 +1,16 @@
+# Leakage windows of the captured firmware (ChipWhisperer, 3000 samples per trace) : the first round sbox output of
+# each key byte. Same values as TME3/dpa_attack.py, they are the defaults of the TME4 attacks and tools.
+#   leakage_points : one sample per key byte (DPA "HW" distinguisher)
+#   leakage_ranges : one [start, end[ window per key byte
+
+leakage_points = [1505, 1760, 2010, 2262,\
+                  1563, 1814, 2067, 2321,\
+                  1618, 1871, 2124, 2376,\
+                  1676, 1927, 2180, 2429]
+
+leakage_ranges = [ \
+    (1505 , 1510), (1755 , 1765), (2005 , 2015), (2254 , 2278), 
+    (1561 , 1565), (1805 , 1820), (2060 , 2075), (2314 , 2326),
+    (1615 , 1625), (1865 , 1878), (2120 , 2130), (2370 , 2384), 
+    (1670 , 1680), (1920 , 1934), (2175 , 2185), (2425 , 2435)  
+]
@@ -0,0 +1,125 @@
+from leakage_windows import leakage_ranges, leakage_points
+from trace_store import TraceStore
+import numpy as np
+import argparse
+import hashlib
+import json
+
+CHUNK_SIZE = 4096
+
+# Preprocessing of a trace set before the attack, chunk by chunk (every step works on each trace independently) :
+#   alignment  : each trace is shifted by the lag of the maximum of its FFT cross-correlation with a reference trace,
+#                in [-max_shift, max_shift] (the samples shifted in repeat the edge sample)
+#   filtering  : low-pass / band-pass, by zeroing the FFT bins out of [low, high] (in cycles per sample, 0.5 is Nyquist)
+#   decimation : mean of each window of `factor` samples (the leakage ranges are divided by factor : Database.load does
+#                it for the ranges it is given, and the default windows of the output are saved in its meta)
+
+DEFAULT_PARAMS = {
+    "align"      : True,
+    "max_shift"  : 50,
+    "align_range": None,           # (start, end) part of the reference used for the alignment, None : the whole trace
+    "low"        : None,           # lowest kept frequency, None : no high-pass
+    "high"       : None,           # highest kept frequency, None : no low-pass
+    "factor"     : 1,              # decimation factor
+}
+
+def fft_size(n):
+    return 1 << (2 * n - 1).bit_length()                         # no circular wrap of the correlation
+
+# lag of each trace (nb_traces,) : the aligned trace is aligned[t] = trace[t + lag]
+def align_shifts(waves, reference, max_shift=50, align_range=None):
+    start, end = align_range if align_range is not None else (0, waves.shape[1])
+    x = waves[:, start:end] - waves[:, start:end].mean(axis=1, keepdims=True)
+    ref = reference[start:end] - reference[start:end].mean()
+
+    n = fft_size(end - start)
+    corr = np.fft.irfft(np.fft.rfft(x, n) * np.conj(np.fft.rfft(ref, n)), n)    # corr[:, lag] (negative lags at the end)
+    lags = np.arange(-max_shift, max_shift + 1)
+    return lags[corr[:, lags % n].argmax(axis=1)]
+
+def apply_shifts(waves, shifts):
+    columns = np.clip(np.arange(waves.shape[1]) + shifts[:, None], 0, waves.shape[1] - 1)
+    return np.take_along_axis(waves, columns, axis=1)
+
+def band_filter(waves, low=None, high=None):
+    spectrum = np.fft.rfft(waves, axis=1)
+    frequencies = np.fft.rfftfreq(waves.shape[1])
+    if low is not None:
+        spectrum[:, frequencies < low] = 0
+    if high is not None:
+        spectrum[:, frequencies > high] = 0
+    return np.fft.irfft(spectrum, waves.shape[1], axis=1)
+
+def decimate(waves, factor):
+    if factor <= 1:
+        return waves
+    nb_samples = waves.shape[1] // factor * factor                 # the last incomplete window is dropped
+    return waves[:, :nb_samples].reshape(len(waves), -1, factor).mean(axis=2)
+
+def decimate_ranges(ranges, factor):
+    return [(start // factor, max(-(-end // factor), start // factor + 1)) for start, end in ranges]
+
+def decimate_points(points, factor):
+    return [point // factor for point in points]
+
+def preprocess(waves, reference=None, params=None):
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    waves = np.asarray(waves, dtype=np.float64)
+    if params["align"]:
+        reference = waves.mean(axis=0) if reference is None else reference
+        waves = apply_shifts(waves, align_shifts(waves, reference, params["max_shift"], params["align_range"]))
+    if params["low"] is not None or params["high"] is not None:
+        waves = band_filter(waves, params["low"], params["high"])
+    return decimate(waves, params["factor"])
+
+# preprocessing of a whole trace store into a new one. The reference is the mean of the first chunk once aligned to its
+# plain mean (the plain mean is blurred by the jitter), it is saved with the output. The parameters, the chunk size (it
+# sets the reference), the source and the default windows in samples of the output are recorded in the output meta once
+# every trace and the reference are saved : when they match and the output is complete, the output is reused.
+
+def preprocess_store(source, output, params=None, encoding="float64", chunk_size=CHUNK_SIZE):
+    params = dict(DEFAULT_PARAMS, **(params or {}))
+    source = TraceStore(source) if not isinstance(source, TraceStore) else source
+    record = {"params" : params, "chunk_size" : chunk_size, "source" : str(source.directory.absolute()), "nb_traces" : len(source),
+              "digest" : hashlib.sha1(json.dumps(source.meta, sort_keys=True).encode()).hexdigest(),
+              "leakage_ranges" : decimate_ranges(leakage_ranges, params["factor"]),
+              "leakage_points" : decimate_points(leakage_points, params["factor"])}
+    record = json.loads(json.dumps(record))
+
+    store = TraceStore(output, encoding)
+    if store.meta.get("preprocessing") == record and len(store) == record["nb_traces"]:
+        return store                                              # same source and parameters : cached result
+    if len(store):
+        raise FileExistsError("{} holds another trace set or an interrupted run".format(output))
+
+    reference = None
+    for _, waves, textin, keys in source.pages(chunk_size):
+        if reference is None:
+            reference = waves.mean(axis=0)
+            if params["align"]:
+                reference = apply_shifts(waves, align_shifts(waves, reference, params["max_shift"], params["align_range"])).mean(axis=0)
+        store.append(preprocess(waves, reference, params), textin, keys)
+    if reference is None:                                         # empty source
+        return store
+    np.save(store.directory / "reference.npy", reference)
+    store.meta["preprocessing"] = record
+    store.save_meta()
+    return store
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description="Align, filter and decimate a trace store into a new one")
+    parser.add_argument("-i", "--input", default="traces_store", help="Source trace store")
+    parser.add_argument("-o", "--output", default="traces_preprocessed", help="Output trace store")
+    parser.add_argument("--no-align", action="store_true", help="Do not align the traces")
+    parser.add_argument("--max-shift", type=int, default=50, help="Largest shift of the alignment")
+    parser.add_argument("--align-range", type=int, nargs=2, help="Part of the reference trace used for the alignment")
+    parser.add_argument("--low", type=float, help="Lowest kept frequency (cycles per sample)")
+    parser.add_argument("--high", type=float, help="Highest kept frequency (cycles per sample)")
+    parser.add_argument("-d", "--decimate", type=int, default=1, help="Decimation factor")
+    parser.add_argument("-e", "--encoding", choices=["float64", "float32", "int16"], default="float64", help="Output encoding")
+    args = parser.parse_args()
+
+    params = {"align" : not args.no_align, "max_shift" : args.max_shift, "align_range" : args.align_range,
+              "low" : args.low, "high" : args.high, "factor" : args.decimate}
+    store = preprocess_store(args.input, args.output, params, args.encoding)
+    print("[*] {} traces of {} samples in {}".format(len(store), store.nb_samples, args.output))
@@ -0,0 +1,85 @@
+from timeit import default_timer as timer
+from contextlib import contextmanager
+import resource
+import pathlib
+import json
+import sys
+
+# Named timers and counters of a run, dumped as a JSON report
+#   timers   : total seconds and number of calls of each phase
+#   counters : accumulated values (traces loaded, bytes decoded, ...)
+# A disabled profiler (enabled=False) records nothing : it is the default of the instrumented functions.
+
+class Profiler:
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.timers = {}
+        self.counters = {}
+        self.start = timer()
+
+    @contextmanager
+    def timer(self, name):
+        if not self.enabled:
+            yield
+            return
+        start = timer()
+        try:
+            yield
+        finally:
+            entry = self.timers.setdefault(name, {"seconds" : 0.0, "calls" : 0})
+            entry["seconds"] += timer() - start
+            entry["calls"] += 1
+
+    def count(self, name, value=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def seconds(self, name):
+        return self.timers.get(name, {"seconds" : 0.0})["seconds"]
+
+    # counter per second of a timer (e.g. traces/s of the loading)
+    def rate(self, counter, name):
+        seconds = self.seconds(name)
+        return self.counters.get(counter, 0) / seconds if seconds > 0 else None
+
+    def report(self, **extra):
+        report = {
+            "total_seconds" : timer() - self.start,
+            "peak_rss_mb"   : peak_rss_mb(),
+            "timers"        : self.timers,
+            "counters"      : self.counters,
+        }
+        report.update(extra)
+        return report
+
+    def save(self, file, **extra):
+        report = self.report(**extra)
+        pathlib.Path(file).write_text(json.dumps(report, indent=2, default=float))
+        return report
+
+# ru_maxrss is in kilobytes on Linux and in bytes on macOS
+def peak_rss_mb():
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+# peak RSS of a part of the run (Linux) : clear_refs resets the high water mark of the process to its current RSS,
+# so VmHWM - VmRSS after the part is what it added, malloc of C libraries included. None where it is not available.
+
+def proc_status_kb(field):
+    for line in pathlib.Path("/proc/self/status").read_text().splitlines():
+        if line.startswith(field + ":"):
+            return int(line.split()[1])
+
+def reset_peak_rss():
+    try:
+        pathlib.Path("/proc/self/clear_refs").write_text("5")
+        return proc_status_kb("VmRSS")
+    except OSError:
+        return None
+
+def peak_rss_since_mb(start_kb):
+    if start_kb is None:
+        return None
+    return max(proc_status_kb("VmHWM") - start_kb, 0) / 1024
+
+NO_PROFILER = Profiler(enabled=False)
@@ -0,0 +1,119 @@
+from synthetic_traces import generate_masked_traces, mask_ranges
+from leakage_windows import leakage_ranges
+from cpa_engine import KEY_LEN, hypothesis_matrix
+from cpa_accumulator import pearson_from_sums
+from timeit import default_timer as timer
+from multiprocessing import Pool
+import numpy as np
+import argparse
+import tempfile
+import pathlib
+
+TILE_SIZE = 32                   # samples of each window per tile : TILE_SIZE^2 combined samples
+CHUNK_SIZE = 1024                # traces per chunk
+
+# Second order CPA against first order masking : the leakage only shows in the centered product of two samples
+#   c[a, b] = (x[a] - mean(x[a])) . (x[b] - mean(x[b]))      a in window A (e.g. the mask), b in window B (the masked value)
+# correlated with the HW[ sbox[pt ^ guess] ] hypothesis. All the (a, b) pairs of two windows can not be combined at once
+# (3000 samples : 4.5M products per trace), so the pairs are cut in tiles of TILE_SIZE x TILE_SIZE, each one a task
+# of the process pool. A task streams the traces by chunks and only keeps the sums of the incremental Pearson formula
+# (cpa_accumulator.pearson_from_sums) for its tile, then returns the best correlation of every guess over the tile.
+# The workers read the traces from a memory mapped .npy file : nothing is copied per task.
+
+def column_means(waves, window, chunk_size=CHUNK_SIZE):
+    start, end = window
+    total = np.zeros(end - start)
+    for i in range(0, len(waves), chunk_size):
+        total += np.asarray(waves[i:i + chunk_size, start:end], dtype=np.float64).sum(axis=0)
+    return total / len(waves)
+
+# best absolute correlation of every guess over the (a, b) pairs of a tile : (bnum, peaks (256,))
+def tile_peaks(task):
+    waves_file, textin_file, bnum, (a0, a1), (b0, b1), mean_a, mean_b, chunk_size = task
+    waves  = np.load(waves_file, mmap_mode='r')
+    textin = np.load(textin_file, mmap_mode='r')
+
+    n = 0
+    sum_x  = np.zeros(256)
+    sum_x2 = np.zeros(256)
+    sum_y  = np.zeros((a1 - a0) * (b1 - b0))
+    sum_y2 = np.zeros_like(sum_y)
+    sum_xy = np.zeros((256, len(sum_y)))
+
+    for i in range(0, len(waves), chunk_size):
+        ya = np.asarray(waves[i:i + chunk_size, a0:a1], dtype=np.float64) - mean_a
+        yb = np.asarray(waves[i:i + chunk_size, b0:b1], dtype=np.float64) - mean_b
+        y  = (ya[:, :, None] * yb[:, None, :]).reshape(len(ya), -1)             # centered products (chunk, tile)
+        x  = hypothesis_matrix(textin[i:i + chunk_size, bnum])                  # (256, chunk)
+
+        n      += len(y)
+        sum_x  += x.sum(axis=1)
+        sum_x2 += (x * x).sum(axis=1)
+        sum_y  += y.sum(axis=0)
+        sum_y2 += (y * y).sum(axis=0)
+        sum_xy += x @ y
+
+    return bnum, np.abs(pearson_from_sums(n, sum_x, sum_x2, sum_y, sum_y2, sum_xy)).max(axis=1)
+
+def tiles(window, tile_size):
+    start, end = window
+    return [(i, min(i + tile_size, end)) for i in range(start, end, tile_size)]
+
+# the arrays are given to the workers as .npy files : a memory map of a whole .npy file is reopened as is,
+# other arrays (or parts of a memory map) are saved once
+def npy_file(array, directory, name):
+    if isinstance(array, np.memmap) and array.filename and pathlib.Path(array.filename).suffix == ".npy":
+        whole = np.load(array.filename, mmap_mode='r')
+        if whole.shape == array.shape and whole.offset == array.offset and whole.dtype == array.dtype:
+            return array.filename
+    file = str(pathlib.Path(directory) / "{}.npy".format(name))
+    np.save(file, np.ascontiguousarray(array))
+    return file
+
+# recover the attacked key bytes with a second order CPA
+#   waves       : (nb_traces, nb_samples) traces, array or memory map
+#   textin      : (nb_traces, KEY_LEN) plain texts
+#   window_pairs: {bnum : ((a_start, a_end), (b_start, b_end))} the two windows combined for each attacked byte
+# returns the recovered bytes {bnum : byte} and the peak correlation of every guess {bnum : (256,)}
+
+def second_order_cpa(waves, textin, window_pairs, tile_size=TILE_SIZE, chunk_size=CHUNK_SIZE, jobs=None):
+    peaks = {bnum : np.zeros(256) for bnum in window_pairs}
+    with tempfile.TemporaryDirectory() as directory:
+        waves_file  = npy_file(waves, directory, "waves")
+        textin_file = npy_file(np.asarray(textin, dtype=np.uint8), directory, "textin")
+        waves = np.load(waves_file, mmap_mode='r')
+
+        tasks = []
+        for bnum, (window_a, window_b) in window_pairs.items():
+            mean_a, mean_b = column_means(waves, window_a, chunk_size), column_means(waves, window_b, chunk_size)
+            for tile_a in tiles(window_a, tile_size):
+                for tile_b in tiles(window_b, tile_size):
+                    tasks.append((waves_file, textin_file, bnum, tile_a, tile_b,
+                                  mean_a[tile_a[0] - window_a[0]:tile_a[1] - window_a[0]],
+                                  mean_b[tile_b[0] - window_b[0]:tile_b[1] - window_b[0]], chunk_size))
+
+        with Pool(jobs) as pool:
+            for bnum, tile in pool.imap_unordered(tile_peaks, tasks):
+                np.maximum(peaks[bnum], tile, out=peaks[bnum])                      # running maximum over the tiles
+
+    return {bnum : int(peaks[bnum].argmax()) for bnum in peaks}, peaks
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description="Second order CPA on synthetic masked AES traces")
+    parser.add_argument("-n", "--nb-traces", type=int, default=5000, help="Number of traces")
+    parser.add_argument("-b", "--bytes", type=int, nargs="+", default=list(range(KEY_LEN)), help="Attacked key bytes")
+    parser.add_argument("--noise", type=float, default=0.01, help="Standard deviation of the gaussian noise")
+    parser.add_argument("--tile-size", type=int, default=TILE_SIZE, help="Samples of each window per tile")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes (default: one per core)")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic traces")
+    args = parser.parse_args()
+
+    waves, textin, key = generate_masked_traces(args.nb_traces, noise=args.noise, seed=args.seed)
+    start = timer()
+    recovered, _ = second_order_cpa(waves, textin, {bnum : (mask_ranges[bnum], leakage_ranges[bnum]) for bnum in args.bytes},
+                                    args.tile_size, jobs=args.jobs)
+    end = timer()
+
+    print("Recovered key: {}".format(" ".join(str(recovered[bnum]) for bnum in args.bytes)))
+    print("Correct   key: {}".format(" ".join(str(key[bnum]) for bnum in args.bytes)))
+    print("The attack took: {:.3f}s".format(end - start))
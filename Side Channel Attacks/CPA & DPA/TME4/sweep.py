@@ -0,0 +1,136 @@
+from synthetic_traces import generate_traces
+from leakage_windows import leakage_points, leakage_ranges
+from benchmark import print_table, save_csv
+from cpa_engine import KEY_LEN, cpa_attack
+from database_utils import Database
+from second_order import npy_file
+from timeit import default_timer as timer
+from multiprocessing import Pool
+from itertools import product
+import numpy as np
+import argparse
+import tempfile
+import pathlib
+import json
+import sys
+
+# TME3 DPA attacks
+sys.path.append(str(pathlib.Path(__file__).absolute().parent.parent / "TME3"))
+
+# Sweep of attack configurations : the trace set is loaded once and saved as .npy files, every worker of the process
+# pool memory maps them once (no copy per worker or per configuration), and each configuration reads its own slice.
+# A configuration is :
+#   engine    : cpa (numpy), cpa_c (C library, one thread per worker), dpa_HW, dpa_MSB, dpa_LSB (TME3 DPA_Attack_vectorized)
+#   nb_traces, offset : the traces [offset, offset + nb_traces[
+#   windows   : name of a window set (leakage_ranges and leakage_points of each byte)
+#   full_wave : the whole wave for every byte instead of the window set (not defined for dpa_HW, which uses points)
+
+ENGINES = ["cpa", "cpa_c", "dpa_HW", "dpa_MSB", "dpa_LSB"]
+
+WINDOW_SETS = {"default" : {"leakage_ranges" : leakage_ranges, "leakage_points" : leakage_points}}
+
+SHARED = {}
+
+# initializer of the workers : memory maps of the trace set, its key and the window sets
+def open_shared(waves_file, textin_file, key, window_sets):
+    SHARED["waves"]       = np.load(waves_file, mmap_mode='r')
+    SHARED["textin"]      = np.load(textin_file, mmap_mode='r')
+    SHARED["key"]         = np.asarray(key, dtype=np.uint8)
+    SHARED["window_sets"] = window_sets
+
+def attack(engine, waves, textin, ranges, points):
+    nb_samples = waves.shape[1]
+    if engine == "cpa":
+        return cpa_attack(waves, textin, ranges)[0]
+    if engine == "cpa_c":
+        from cpa_bridge import load_lib, windows_layout, cpa_attack_parallel
+        if "lib" not in SHARED:
+            SHARED["lib"] = load_lib()
+        columns, starts, intervals = windows_layout(ranges, nb_samples)
+        waves = np.ascontiguousarray(waves if columns is None else waves[:, columns], dtype=np.float64)
+        return cpa_attack_parallel(SHARED["lib"], waves, np.ascontiguousarray(textin), starts, intervals, 1)[0]
+
+    from dpa_attack import DPA_Attack_vectorized
+    ranges = [range(0, nb_samples)] * KEY_LEN if ranges is None else [range(start, end) for start, end in ranges]
+    return DPA_Attack_vectorized(waves, textin, engine[len("dpa_"):], points, ranges)
+
+def run_config(config):
+    window_set = SHARED["window_sets"][config["windows"]]
+    waves  = SHARED["waves"][config["offset"]:config["offset"] + config["nb_traces"]]
+    textin = SHARED["textin"][config["offset"]:config["offset"] + config["nb_traces"]]
+    ranges = None if config["full_wave"] else window_set["leakage_ranges"]
+
+    start = timer()
+    try:
+        key = np.asarray(attack(config["engine"], waves, textin, ranges, window_set["leakage_points"]), dtype=np.uint8)
+        error = ""
+    except (ImportError, OSError) as err:                          # missing TME3 dependencies or C library not built
+        key, error = None, repr(err)
+    elapsed = timer() - start
+
+    correct = 0 if key is None else int((key == SHARED["key"]).sum())
+    return dict(config, attacked=len(waves), time_s=elapsed, correct_bytes=correct, success=correct == KEY_LEN,
+                recovered_key="" if key is None else bytes(key).hex(), error=error)
+
+def grid(engines, trace_counts, offsets, windows, full_wave):
+    return [{"engine" : engine, "nb_traces" : nb_traces, "offset" : offset, "windows" : window, "full_wave" : full}
+            for engine, nb_traces, offset, window, full in product(engines, trace_counts, offsets, windows, full_wave)
+            if not (full and engine == "dpa_HW")]
+
+# runs the configurations on a process pool : waves (nb_traces, nb_samples), textin (nb_traces, KEY_LEN), key (KEY_LEN,)
+# every configuration must fit in the trace set
+def sweep(waves, textin, key, configs, jobs=None, window_sets=WINDOW_SETS):
+    too_long = [c for c in configs if c["offset"] + c["nb_traces"] > len(waves)]
+    if too_long:
+        raise ValueError("{} configurations run past the {} traces of the set, e.g. offset {} + {} traces".format(
+                         len(too_long), len(waves), too_long[0]["offset"], too_long[0]["nb_traces"]))
+    with tempfile.TemporaryDirectory() as directory:
+        waves_file  = npy_file(waves, directory, "waves")
+        textin_file = npy_file(np.asarray(textin, dtype=np.uint8), directory, "textin")
+        with Pool(jobs, initializer=open_shared, initargs=(waves_file, textin_file, key, window_sets)) as pool:
+            return pool.map(run_config, configs)
+
+# window sets of leakage_assessment.py (cached JSON results) : name=file
+def load_window_sets(specs):
+    for spec in specs:
+        name, file = spec.split("=", 1)
+        result = json.loads(pathlib.Path(file).read_text())
+        WINDOW_SETS[name] = {"leakage_ranges" : [tuple(w) for w in result["leakage_ranges"]], "leakage_points" : result["leakage_points"]}
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description="Run a grid of attack configurations on one trace set, on a process pool")
+    parser.add_argument("-f", "--file", default="traces.db", help="Trace database")
+    parser.add_argument("--backend", choices=["sqlite", "store"], default="sqlite", help="Database backend")
+    parser.add_argument("--synthetic", action="store_true", help="Use synthetic traces instead of the database")
+    parser.add_argument("-s", "--samples", type=int, default=3000, help="Number of samples per trace")
+    parser.add_argument("-e", "--engines", nargs="+", default=ENGINES, choices=ENGINES, help="Attacks of the grid")
+    parser.add_argument("-t", "--traces", type=int, nargs="+", default=[50, 100, 200], help="Trace counts of the grid")
+    parser.add_argument("--offsets", type=int, nargs="+", default=[0], help="Trace offsets of the grid")
+    parser.add_argument("-w", "--windows", nargs="+", default=["default"], help="Window sets of the grid")
+    parser.add_argument("--window-file", nargs="+", default=[], help="Extra window sets, as name=leakage_assessment JSON file")
+    parser.add_argument("--full-wave", choices=["off", "on", "both"], default="off", help="Whole wave instead of the windows")
+    parser.add_argument("-j", "--jobs", type=int, help="Number of worker processes (default: one per core)")
+    parser.add_argument("--csv", help="Also write the results to this CSV file")
+    args = parser.parse_args()
+
+    load_window_sets(args.window_file)
+    configs = grid(args.engines, args.traces, args.offsets, args.windows, {"off" : [False], "on" : [True], "both" : [False, True]}[args.full_wave])
+    nb_traces = max(c["offset"] + c["nb_traces"] for c in configs)
+
+    if args.synthetic:
+        waves, textin, key = generate_traces(nb_traces, args.samples, seed=0)
+    else:
+        db = Database(file=args.file, backend=args.backend)
+        waves, textin, keys = db.load(nb_traces, 0, args.samples)
+        key = keys[0]
+        WINDOW_SETS["default"] = {"leakage_ranges" : db.sample_ranges(leakage_ranges), "leakage_points" : db.sample_points(leakage_points)}
+    print("[*] {} traces loaded, {} configurations".format(len(waves), len(configs)))
+    if len(waves) < nb_traces:
+        parser.error("the configurations need {} traces, the database holds {}".format(nb_traces, len(waves)))
+
+    start = timer()
+    results = sweep(waves, textin, key, configs, args.jobs)
+    print_table(results, ["engine", "nb_traces", "offset", "windows", "full_wave", "attacked", "time_s", "correct_bytes", "success", "error"])
+    print("[*] Sweep took {:.3f}s".format(timer() - start))
+    if args.csv and results:
+        save_csv(results, args.csv)
@@ -0,0 +1,37 @@
+from leakage_windows import leakage_ranges
+from hypothesis import KEY_LEN, SBOX, HW
+import numpy as np
+
+# simulated AES captures : gaussian noise, plus amplitude * HW(sbox[pt ^ k]) on the leakage range of each key byte
+# returns the waves (nb_traces, nb_samples), the plain texts (nb_traces, KEY_LEN) and the key (KEY_LEN,)
+
+def generate_traces(nb_traces, nb_samples=3000, noise=0.02, amplitude=0.01, key=None, ranges=leakage_ranges, seed=None):
+    rng = np.random.default_rng(seed)
+    key = rng.integers(0, 256, KEY_LEN, dtype=np.uint8) if key is None else np.asarray(key, dtype=np.uint8)
+
+    textin = rng.integers(0, 256, (nb_traces, KEY_LEN), dtype=np.uint8)
+    waves  = rng.normal(0, noise, (nb_traces, nb_samples))
+
+    for bnum, (start, end) in enumerate(ranges):
+        waves[:, start:end] += amplitude * HW[SBOX[textin[:, bnum] ^ key[bnum]]][:, None]
+
+    return waves, textin, key
+
+# first-order boolean masked AES : a random mask m per trace and byte, HW(m) leaks on the mask range and HW(sbox[pt ^ k] ^ m)
+# on the leakage range, so no single sample depends on the key (second order attack : second_order.py)
+mask_ranges = [(start - 1000, end - 1000) for start, end in leakage_ranges]
+
+def generate_masked_traces(nb_traces, nb_samples=3000, noise=0.02, amplitude=0.01, key=None, ranges=leakage_ranges,
+                           masks=mask_ranges, seed=None):
+    rng = np.random.default_rng(seed)
+    key = rng.integers(0, 256, KEY_LEN, dtype=np.uint8) if key is None else np.asarray(key, dtype=np.uint8)
+
+    textin = rng.integers(0, 256, (nb_traces, KEY_LEN), dtype=np.uint8)
+    mask   = rng.integers(0, 256, (nb_traces, KEY_LEN), dtype=np.uint8)
+    waves  = rng.normal(0, noise, (nb_traces, nb_samples))
+
+    for bnum, ((start, end), (mask_start, mask_end)) in enumerate(zip(ranges, masks)):
+        waves[:, mask_start:mask_end] += amplitude * HW[mask[:, bnum]][:, None]
+        waves[:, start:end] += amplitude * HW[SBOX[textin[:, bnum] ^ key[bnum]] ^ mask[:, bnum]][:, None]
+
+    return waves, textin, key
@@ -0,0 +1,177 @@
+import numpy as np
+import argparse
+import pathlib
+import json
+import os
+
+KEY_LEN = 16
+BLOCK_SIZE = 4096                    # traces per block file
+INT16_MAX = 32767
+
+# Column oriented trace store : a directory of blocks of BLOCK_SIZE traces, each one a memory mapped .npy file of shape
+# (nb_samples, BLOCK_SIZE) (sample major). The samples of a window for a range of traces are contiguous rows of the
+# blocks, so reading the leakage ranges only reads those bytes from the disk, and nothing is unpacked.
+#   meta.json              : nb_samples, nb_traces, block_size, encoding, scale, offset, clipped
+#   samples_<block>.npy    : (nb_samples, block_size) float64 / float32 / int16
+#   textin_<block>.npy     : (block_size, KEY_LEN) uint8
+#   keys_<block>.npy       : (block_size, KEY_LEN) uint8
+# int16 encoding (optional, lossy) : sample = value * scale + offset. The scale is fixed at the first append with a 2x
+# margin over the range of the first batch, later samples out of the range are clipped : they are counted in
+# meta["clipped"] and each append that clips prints a warning.
+
+ENCODINGS = {"float64" : np.float64, "float32" : np.float32, "int16" : np.int16}
+
+class TraceStore:
+    def __init__(self, directory, encoding="float64", block_size=BLOCK_SIZE):
+        self.directory = pathlib.Path(directory)
+        self.meta_file = self.directory / "meta.json"
+        self.blocks = {}
+
+        if self.meta_file.exists():                           # existing store : its own encoding and block size
+            self.meta = json.loads(self.meta_file.read_text())
+        else:                                                 # created at the first append, when nb_samples is known
+            if encoding not in ENCODINGS:
+                raise ValueError("Unknown encoding: {}".format(encoding))
+            self.meta = {"nb_samples" : None, "nb_traces" : 0, "block_size" : block_size, "encoding" : encoding,
+                         "scale" : 1.0, "offset" : 0.0, "clipped" : 0}
+
+    def __len__(self):
+        return self.meta["nb_traces"]
+
+    @property
+    def nb_samples(self):
+        return self.meta["nb_samples"]
+
+    def block_files(self, block):
+        return [self.directory / "{}_{:05d}.npy".format(name, block) for name in ("samples", "textin", "keys")]
+
+    # memory maps of a block : samples, textin, keys
+    def block(self, block, mode='r'):
+        if (block, mode) not in self.blocks:
+            samples_file, textin_file, keys_file = self.block_files(block)
+            if not samples_file.exists():
+                size = self.meta["block_size"]
+                np.lib.format.open_memmap(samples_file, mode='w+', dtype=ENCODINGS[self.meta["encoding"]], shape=(self.nb_samples, size))
+                np.lib.format.open_memmap(textin_file, mode='w+', dtype=np.uint8, shape=(size, KEY_LEN))
+                np.lib.format.open_memmap(keys_file, mode='w+', dtype=np.uint8, shape=(size, KEY_LEN))
+            self.blocks[(block, mode)] = [np.load(f, mmap_mode=mode) for f in (samples_file, textin_file, keys_file)]
+        return self.blocks[(block, mode)]
+
+    # returns the encoded waves and the number of clipped samples
+    def encode(self, waves):
+        if self.meta["encoding"] != "int16":
+            return waves, 0
+        samples = np.rint((waves - self.meta["offset"]) / self.meta["scale"])
+        clipped = int(np.count_nonzero(np.abs(samples) > INT16_MAX))
+        return np.clip(samples, -INT16_MAX, INT16_MAX), clipped
+
+    def decode(self, samples):
+        samples = np.asarray(samples, dtype=np.float64)
+        if self.meta["encoding"] != "int16":
+            return samples
+        return samples * self.meta["scale"] + self.meta["offset"]
+
+    # appends a batch : waves (n, nb_samples), textin (n, KEY_LEN), keys (n, KEY_LEN) or one key for the batch
+    def append(self, waves, textin, keys):
+        waves = np.asarray(waves, dtype=np.float64)
+        if len(waves) == 0:
+            return self
+        textin = np.asarray(textin, dtype=np.uint8)
+        keys = np.broadcast_to(np.asarray(keys, dtype=np.uint8), textin.shape)
+
+        if self.meta["nb_samples"] is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            self.meta["nb_samples"] = waves.shape[1]
+            if self.meta["encoding"] == "int16":
+                low, high = float(waves.min()), float(waves.max())
+                self.meta["offset"] = (high + low) / 2
+                self.meta["scale"] = max(high - low, 1e-12) / INT16_MAX     # half range * 2 margin
+        waves, clipped = self.encode(waves[:, :self.nb_samples])
+        if clipped:
+            print("[!] {} samples out of the int16 range of {} were clipped".format(clipped, self.directory))
+
+        size, done, touched = self.meta["block_size"], 0, []
+        while done < len(waves):
+            index = self.meta["nb_traces"] + done
+            block, first = divmod(index, size)
+            count = min(size - first, len(waves) - done)
+            samples, block_textin, block_keys = self.block(block, 'r+')
+            samples[:, first:first + count] = waves[done:done + count].T
+            block_textin[first:first + count] = textin[done:done + count]
+            block_keys[first:first + count] = keys[done:done + count]
+            done += count
+            touched.append((samples, block_textin, block_keys))
+
+        for arrays in touched:
+            for array in arrays:
+                array.flush()
+        self.meta["nb_traces"] += len(waves)
+        self.meta["clipped"] = self.meta.get("clipped", 0) + clipped
+        self.save_meta()
+        return self
+
+    def save_meta(self):
+        tmp_file = self.meta_file.with_suffix(".tmp")
+        tmp_file.write_text(json.dumps(self.meta))
+        os.replace(tmp_file, self.meta_file)                   # readers never see a partial file
+
+    # traces [start, stop[, only the samples of the windows (list of (start, end)), concatenated in the windows order
+    # (the layout of cpa_bridge.windows_layout). windows = None : the whole waves
+    # returns waves (n, nb_columns) float64, textin (n, KEY_LEN), keys (n, KEY_LEN)
+    def read(self, start=0, stop=None, windows=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        start = min(start, stop)
+        windows = [(0, self.nb_samples)] if windows is None else windows
+        nb_columns = sum(end - begin for begin, end in windows)
+
+        waves  = np.empty((stop - start, nb_columns), dtype=np.float64)
+        textin = np.empty((stop - start, KEY_LEN), dtype=np.uint8)
+        keys   = np.empty((stop - start, KEY_LEN), dtype=np.uint8)
+
+        size, index = self.meta["block_size"], start
+        while index < stop:
+            block, first = divmod(index, size)
+            count = min(size - first, stop - index)
+            samples, block_textin, block_keys = self.block(block)
+            row, column = index - start, 0
+            for begin, end in windows:
+                waves[row:row + count, column:column + end - begin] = self.decode(samples[begin:end, first:first + count]).T
+                column += end - begin
+            textin[row:row + count] = block_textin[first:first + count]
+            keys[row:row + count] = block_keys[first:first + count]
+            index += count
+
+        return waves, textin, keys
+
+    # keyset pagination : pages of at most page_size traces after the trace index `after` (excluded),
+    # each page is (last index, waves, textin, keys) : the last index is the key of the next page
+    def pages(self, page_size=BLOCK_SIZE, after=-1, windows=None):
+        while after + 1 < len(self):
+            waves, textin, keys = self.read(after + 1, after + 1 + page_size, windows)
+            after += len(waves)
+            yield after, waves, textin, keys
+
+# converts a sqlite trace database into a trace store, by keyset pages of the Trace table
+def convert_db(db_file, directory, nb_samples=3000, encoding="float64", page_size=10000):
+    from database_utils import Database
+    db = Database(file=db_file)
+    store = TraceStore(directory, encoding)
+    for rows in db.pages(page_size):
+        waves  = [np.frombuffer(row.wave, dtype=np.float64, count=nb_samples) for row in rows]
+        textin = [np.frombuffer(bytes.fromhex(row.textin), dtype=np.uint8) for row in rows]
+        keys   = [np.frombuffer(bytes.fromhex(row.key), dtype=np.uint8) for row in rows]
+        store.append(waves, textin, keys)
+    return store
+
+if __name__ == '__main__' :
+    parser = argparse.ArgumentParser(description="Convert a sqlite trace database into a column oriented trace store")
+    parser.add_argument("-f", "--file", default="traces.db", help="Trace database")
+    parser.add_argument("-o", "--output", default="traces_store", help="Trace store directory")
+    parser.add_argument("-s", "--samples", type=int, default=3000, help="Number of samples per trace")
+    parser.add_argument("-e", "--encoding", choices=list(ENCODINGS), default="float64", help="Sample encoding (float32 and int16 are lossy)")
+    args = parser.parse_args()
+
+    store = convert_db(args.file, args.output, args.samples, args.encoding)
+    print("[*] {} traces of {} samples stored in {} ({})".format(len(store), store.nb_samples, args.output, store.meta["encoding"]))
+    if store.meta.get("clipped"):
+        print("[!] {} samples were clipped to the int16 range".format(store.meta["clipped"]))